@@ -0,0 +1,403 @@
+"""Offline fan-out benchmark for main.py.
+
+Runs the real stock/weather/countdown code paths against a local stand-in
+for the upstream API and a fake Discord layer that records sends and edits,
+adds latency and answers some requests with 429s. No network or bot token
+is needed.
+
+    python benchmark.py --guilds 1000 10000 50000
+    python benchmark.py --guilds 5000 --payload recorded_stock.json --rate-limit 0.02
+    python benchmark.py --guilds 1000 --upstream-errors 0.3 --upstream-hangs 0.1
+"""
+import argparse
+import asyncio
+import gc
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from types import SimpleNamespace
+
+from aiohttp import web
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+# --- Fake upstream API ---
+class FakeUpstream:
+    """Serves synthetic (or recorded) stock and weather payloads with ETags.
+
+    Faults can be injected: a fraction of requests answered with 503, a
+    fraction that hang for `hang_for` seconds, and a fixed extra delay.
+    """
+
+    def __init__(self, recorded_stock=None, items_per_category=8, error_rate=0.0, hang_rate=0.0, delay=0.0, hang_for=30.0):
+        self.recorded_stock = recorded_stock
+        self.items_per_category = items_per_category
+        self.error_rate = error_rate
+        self.hang_rate = hang_rate
+        self.delay = delay
+        self.hang_for = hang_for
+        self.rotation = 0
+        self.requests = 0
+        self.runner = None
+        self.port = None
+
+    def stock_payload(self):
+        if self.recorded_stock is not None:
+            return self.recorded_stock
+        now = int(time.time())
+        start = now - 10
+        payload = {}
+        for api_key in ("seed_stock", "gear_stock", "egg_stock", "cosmetic_stock", "eventshop_stock"):
+            payload[api_key] = [
+                {
+                    "item_id": f"{api_key}_{self.rotation}_{n}",
+                    "display_name": f"Item {n}",
+                    "quantity": random.randint(1, 10),
+                    "price": random.randint(10, 100000),
+                    "icon": f"https://example.invalid/{n}.png",
+                    "start_date_unix": start + self.rotation,
+                    "end_date_unix": start + self.rotation + 300
+                }
+                for n in range(self.items_per_category)
+            ]
+        return payload
+
+    def weather_payload(self):
+        now = int(time.time())
+        return {"weather": [{
+            "weather_id": "rain",
+            "weather_name": "Rain",
+            "description": "Synthetic weather",
+            "active": True,
+            "start_duration_unix": now - 5 + self.rotation,
+            "duration": 180
+        }]}
+
+    async def _respond(self, request, payload):
+        self.requests += 1
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        if random.random() < self.hang_rate:
+            await asyncio.sleep(self.hang_for)
+        if random.random() < self.error_rate:
+            return web.Response(status=503, text="injected fault")
+        etag = f'"{self.rotation}"'
+        if request.headers.get("If-None-Match") == etag:
+            return web.Response(status=304)
+        return web.json_response(payload, headers={"ETag": etag})
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get("/stock", lambda r: self._respond(r, self.stock_payload()))
+        app.router.add_get("/weather", lambda r: self._respond(r, self.weather_payload()))
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        await self.runner.cleanup()
+
+
+# --- Fake Discord layer ---
+class FakeDiscord:
+    """Stands in for bot.get_guild / get_channel / get_partial_messageable"""
+
+    def __init__(self, main, latency, rate_limit):
+        self.main = main
+        self.latency = latency
+        self.rate_limit = rate_limit
+        self.guilds = {}
+        self.channels = {}
+        self.sends = 0
+        self.edits = 0
+        self.rate_limited = 0
+        self.next_message_id = 1
+
+    async def _request(self):
+        await asyncio.sleep(random.uniform(0.5, 1.5) * self.latency)
+        if self.rate_limit and random.random() < self.rate_limit:
+            self.rate_limited += 1
+            raise self.main.discord.RateLimited(0.05)
+
+    def make_channel(self, channel_id):
+        fake = self
+
+        async def pin():
+            await fake._request()
+
+        async def send(**kwargs):
+            await fake._request()
+            fake.sends += 1
+            fake.next_message_id += 1
+            return SimpleNamespace(id=fake.next_message_id, channel=channel, pin=pin)
+
+        def get_partial_message(message_id):
+            async def edit(**kwargs):
+                await fake._request()
+                fake.edits += 1
+            return SimpleNamespace(id=message_id, edit=edit)
+
+        channel = SimpleNamespace(id=channel_id, send=send, get_partial_message=get_partial_message)
+        return channel
+
+    def partial_messageable(self, channel_id):
+        # Partial messageables are how countdown edits and watch DMs are sent
+        return self.make_channel(channel_id)
+
+    def install(self, guild_count, channel_types, post_mode="new"):
+        main = self.main
+        for guild_id in range(1, guild_count + 1):
+            self.guilds[guild_id] = SimpleNamespace(id=guild_id, name=f"Guild {guild_id}")
+            config = main.get_server_config(guild_id, create=True)
+            config["server_name"] = f"Guild {guild_id}"
+            config["post_mode"] = post_mode
+            for n, channel_type in enumerate(channel_types):
+                channel_id = guild_id * 100 + n
+                self.channels[channel_id] = self.make_channel(channel_id)
+                config[f"{channel_type}_channel_id"] = channel_id
+        main.rebuild_subscriptions()
+        main.bot.get_guild = self.guilds.get
+        main.bot.get_channel = self.channels.get
+        main.bot.get_partial_messageable = self.partial_messageable
+
+
+# --- Measurements ---
+class LoopLagProbe:
+    """Measures how late a 10ms sleep wakes up while the scenario runs"""
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.samples = []
+        self.task = None
+
+    async def _run(self):
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.samples.append(time.perf_counter() - start - self.interval)
+
+    def __enter__(self):
+        self.task = asyncio.ensure_future(self._run())
+        return self
+
+    def __exit__(self, *exc):
+        self.task.cancel()
+
+    def summary(self):
+        if not self.samples:
+            return 0.0, 0.0
+        ordered = sorted(self.samples)
+        p99 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))]
+        return ordered[len(ordered) // 2] * 1000, p99 * 1000
+
+
+async def measure(name, fake, coro_factory):
+    gc.collect()
+    sends, edits = fake.sends, fake.edits
+    mem_before = tracemalloc.get_traced_memory()[0]
+    with LoopLagProbe() as probe:
+        start = time.perf_counter()
+        await coro_factory()
+        duration = time.perf_counter() - start
+    mem_after = tracemalloc.get_traced_memory()[0]
+    sent = fake.sends - sends
+    edited = fake.edits - edits
+    lag_p50, lag_p99 = probe.summary()
+    rate = (sent + edited) / duration if duration else 0
+    print(
+        f"  {name:<22} {duration:8.2f}s  sends {sent:>6}  edits {edited:>6}  "
+        f"{rate:9.0f} req/s  mem {(mem_after - mem_before) / 1024 / 1024:+7.2f} MiB  "
+        f"loop lag p50 {lag_p50:6.2f}ms p99 {lag_p99:7.2f}ms"
+    )
+
+
+async def run_scenarios(main, upstream, args, guild_count):
+    fake = FakeDiscord(main, args.latency, args.rate_limit)
+    fake.install(guild_count, args.channel_types, "board" if args.board else "new")
+    if args.global_rate:
+        main.delivery.global_bucket = main.TokenBucket(args.global_rate, 1.0)
+    else:
+        main.delivery.global_bucket = main.TokenBucket(10 ** 9, 1.0)
+    main.EDIT_BUDGET_PER_MINUTE = args.edit_budget
+
+    print(f"\n{guild_count} guilds ({', '.join(args.channel_types)})")
+    await measure("stock rotation", fake, main.check_new_stock)
+    await measure("stock unchanged", fake, main.check_new_stock)
+    if "weather" in args.channel_types:
+        await measure("weather event", fake, main.check_new_weather)
+
+    upstream.rotation += 1
+    if args.watchers:
+        add_watchers(main, args.watchers, guild_count, upstream.rotation, args.items)
+    await measure("next stock rotation", fake, main.check_new_stock)
+    if args.watchers:
+        await measure("watch notifications", fake, lambda: asyncio.gather(*main.watch_tasks))
+
+    # Make every countdown due, as at a minute rollover, and run edit ticks
+    now = time.time()
+    for key, post in main.active_events["stock"].items():
+        post.rendered = None
+        post.next_edit_at = now
+        main.countdown_timers.schedule(now, "stock", key)
+
+    async def countdown_ticks():
+        for _ in range(args.edit_ticks):
+            await main.update_active_events.coro()
+
+    await measure(f"{args.edit_ticks} countdown ticks", fake, countdown_ticks)
+    await upstream_outage(main, upstream)
+    await archive_restart(main)
+    print(
+        f"  active stock {len(main.active_events['stock'])}, weather {len(main.active_events['weather'])}, "
+        f"snapshots {len(main.snapshot_store.snapshots)}, 429s {fake.rate_limited}, upstream requests {upstream.requests}"
+    )
+
+
+def add_watchers(main, count, guild_count, rotation, items):
+    """Watch items of the coming seed rotation; odd users want mentions, even ones DMs"""
+    start = time.perf_counter()
+    for n in range(1, count + 1):
+        main.watch_index.watch(
+            10 ** 6 + n, f"seed_stock_{rotation}_{n % items}", "mention" if n % 2 else "dm",
+            guild_id=n % guild_count + 1, dm_channel_id=10 ** 9 + n
+        )
+    # Watches are persisted write-behind; drop the queue, this is not a state store benchmark
+    main.state_store.pending.clear()
+    # Same unthrottled settings as the main engine, to measure bot-side overhead
+    main.dm_delivery = main.DeliveryEngine()
+    main.dm_delivery.global_bucket = main.delivery.global_bucket
+    print(f"  {'index ' + str(count) + ' watches':<22} {time.perf_counter() - start:8.2f}s")
+
+
+async def upstream_outage(main, upstream, polls=20):
+    """Fail every upstream request and check the breaker and /stock fallback"""
+    error_rate, stale_ttl = upstream.error_rate, main.snapshot_cache.stale_ttl
+    upstream.error_rate = 1.0
+    before = upstream.requests
+    logger = logging.getLogger()
+    level = logger.level
+    logger.setLevel(logging.CRITICAL)
+    start = time.perf_counter()
+    try:
+        for _ in range(polls):
+            await main.check_new_stock()
+        # Well within stale_ttl, but the breaker is open: /stock must flag it
+        stale = main.snapshot_cache.is_stale(main.STOCK_API_URL)
+        # Pretend the cached snapshot is too old to serve normally
+        main.snapshot_cache.stale_ttl = 0
+        _, data = await main.snapshot_cache.get(main.STOCK_API_URL)
+    finally:
+        logger.setLevel(level)
+        upstream.error_rate = error_rate
+        main.snapshot_cache.stale_ttl = stale_ttl
+    breaker = main.http_client.breaker(main.STOCK_API_URL)
+    print(
+        f"  {'upstream outage':<22} {time.perf_counter() - start:8.2f}s  {polls} polls -> "
+        f"{upstream.requests - before} upstream requests, breaker {breaker.state}, "
+        f"/stock {'served last good snapshot' if data is not None else 'had nothing to serve'}"
+        f"{', marked stale' if stale else ', NOT marked stale'}"
+    )
+
+
+async def archive_restart(main):
+    """Record, shut down, restart and record a new item; each must keep its own history"""
+    start = time.perf_counter()
+    path = os.path.join(os.getcwd(), "archive-check")
+    db = os.path.join(path, "check.db")
+    os.makedirs(path, exist_ok=True)
+
+    store = main.StateStore(db)
+    archive = main.StockArchive(path, store)
+    archive.load()
+    archive.record("seed", 1000, 1300, [("carrot", "Carrot", 10, 1)])
+    # Same order as StockBot.close
+    await archive.flush()
+    await store.flush()
+    store.close()
+
+    store = main.StateStore(db)
+    archive = main.StockArchive(path, store)
+    archive.load()
+    archive.record("seed", 2000, 2300, [("tomato", "Tomato", 20, 2)])
+    await archive.flush()
+    seen = {}
+    for item_id in ("carrot", "tomato"):
+        found = await archive.history(item_id)
+        seen[item_id] = [row["start"] for row in found[2]] if found else None
+    store.close()
+    ok = seen == {"carrot": [1000], "tomato": [2000]}
+    print(
+        f"  {'archive restart':<22} {time.perf_counter() - start:8.2f}s  "
+        f"{'history kept apart' if ok else 'MISMATCH ' + str(seen)}"
+    )
+
+
+def load_main(upstream_port, workdir, read_timeout=2.0):
+    os.environ["UPSTREAM_READ_TIMEOUT"] = str(read_timeout)
+    os.environ["STOCK_API_URL"] = f"http://127.0.0.1:{upstream_port}/stock"
+    os.environ["WEATHER_API_URL"] = f"http://127.0.0.1:{upstream_port}/weather"
+    os.chdir(workdir)
+    sys.path.insert(0, REPO_DIR)
+    import main
+    return main
+
+
+async def run(args):
+    recorded = None
+    if args.payload:
+        with open(args.payload) as f:
+            recorded = json.load(f)
+    upstream = FakeUpstream(recorded, args.items, args.upstream_errors, args.upstream_hangs, args.upstream_delay, hang_for=3.0)
+    await upstream.start()
+    tracemalloc.start()
+    try:
+        for guild_count in args.guilds:
+            # Fresh interpreter state per size: main keeps module-level state
+            sys.modules.pop("main", None)
+            cwd = os.getcwd()
+            with tempfile.TemporaryDirectory(prefix="bench-") as workdir:
+                main = load_main(upstream.port, workdir)
+                main.http_client.backoff = 0.01
+                logging.getLogger().setLevel(logging.INFO if args.verbose else logging.WARNING)
+                try:
+                    await run_scenarios(main, upstream, args, guild_count)
+                finally:
+                    await main.http_client.close()
+                    main.state_store.close()
+                    os.chdir(cwd)
+    finally:
+        tracemalloc.stop()
+        await upstream.stop()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Offline fan-out benchmark")
+    parser.add_argument("--guilds", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--channel-types", nargs="+", default=["seed", "gear", "weather"])
+    parser.add_argument("--items", type=int, default=8, help="synthetic items per category")
+    parser.add_argument("--payload", help="recorded stock JSON to serve instead of synthetic data")
+    parser.add_argument("--latency", type=float, default=0.02, help="mean fake Discord latency (s)")
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="fraction of requests answered with 429")
+    parser.add_argument("--global-rate", type=int, default=0,
+                        help="delivery global bucket (req/s); 0 disables it to measure bot-side overhead")
+    parser.add_argument("--edit-budget", type=int, default=600, help="EDIT_BUDGET_PER_MINUTE")
+    parser.add_argument("--edit-ticks", type=int, default=3)
+    parser.add_argument("--board", action="store_true", help="live-board mode: rotations edit one message per channel")
+    parser.add_argument("--watchers", type=int, default=0, help="restock watches matching the next seed rotation")
+    parser.add_argument("--upstream-errors", type=float, default=0.0, help="fraction of upstream requests answered with 503")
+    parser.add_argument("--upstream-hangs", type=float, default=0.0, help="fraction of upstream requests that hang past the read timeout")
+    parser.add_argument("--upstream-delay", type=float, default=0.0, help="extra upstream latency (s)")
+    parser.add_argument("--verbose", action="store_true")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    asyncio.run(run(parse_args()))
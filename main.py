@@ -1,6 +1,8 @@
 
 import os
 import json
+import sys
+import random
 import discord
 import asyncio
 from discord.ext import commands, tasks
@@ -11,21 +13,129 @@ import requests
 from dotenv import load_dotenv
 from datetime import datetime, timezone, timedelta
 import time
+import math
 import logging
+from collections import deque
+import heapq
+import bisect
+import hashlib
+import sqlite3
+import struct
+import zlib
+import mmap
+import threading
+from contextlib import contextmanager
+from aiohttp import web
+import numpy as np
 load_dotenv()
 
 TOKEN = 'BOT TOKEN'
 CONFIG_FILE = "channels.json"
 LAST_STATE_FILE = "last_state.json"
+STATE_DB_FILE = "state.db"
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", "archive")
+
+# Deployment mode: "bot" (single process), "shard" (one shard range fed by the
+# poller), "poller" (fetch upstream once for all shards), "stub_shard" (log
+# what the poller publishes, for local testing without Discord)
+RUN_MODE = os.getenv("RUN_MODE", "bot")
+SHARD_COUNT = int(os.getenv("SHARD_COUNT", "1"))
+SHARD_IDS = [int(s) for s in os.getenv("SHARD_IDS", "").split(",") if s.strip()]
+POLLER_SOCKET = os.getenv("POLLER_SOCKET", "poller.sock")
 WEBHOOK_URL = "Webhook Url"
 
+# --- State Store ---
+class StateStore:
+    """SQLite (WAL) key/value store for server configs and last sent state.
+
+    Writes are per-key upserts collected in memory and committed in one
+    transaction by flush(), which runs the SQLite work in a thread so the
+    event loop never blocks on disk.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        # Shards share the file; WAL lets them read while another one commits
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS kv ("
+            "scope TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, "
+            "PRIMARY KEY (scope, key)) WITHOUT ROWID"
+        )
+        self.pending = {}  # (scope, key) -> JSON text, or None to delete
+        self.db_lock = threading.Lock()
+        self.stats = {"commits": 0, "rows_written": 0}
+
+    def load_scope(self, scope):
+        with self.db_lock:
+            rows = self.conn.execute("SELECT key, value FROM kv WHERE scope = ?", (scope,)).fetchall()
+        return {key: json.loads(value) for key, value in rows}
+
+    def put(self, scope, key, value):
+        self.pending[(scope, key)] = json.dumps(value, separators=(",", ":"))
+
+    def delete(self, scope, key):
+        self.pending[(scope, key)] = None
+
+    def _write(self, batch):
+        upserts = [(scope, key, value) for (scope, key), value in batch.items() if value is not None]
+        deletes = [(scope, key) for (scope, key), value in batch.items() if value is None]
+        with self.db_lock:
+            self.conn.execute("BEGIN")
+            try:
+                self.conn.executemany(
+                    "INSERT INTO kv (scope, key, value) VALUES (?, ?, ?) "
+                    "ON CONFLICT (scope, key) DO UPDATE SET value = excluded.value",
+                    upserts
+                )
+                self.conn.executemany("DELETE FROM kv WHERE scope = ? AND key = ?", deletes)
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+        self.stats["commits"] += 1
+        self.stats["rows_written"] += len(batch)
+
+    def _take_batch(self):
+        batch, self.pending = self.pending, {}
+        return batch
+
+    async def flush(self):
+        """Commit pending writes off the event loop"""
+        if not self.pending:
+            return
+        batch = self._take_batch()
+        try:
+            await asyncio.to_thread(self._write, batch)
+        except Exception as e:
+            # Put the batch back unless newer values were queued meanwhile
+            for item, value in batch.items():
+                self.pending.setdefault(item, value)
+            logging.error(f"⚠️ State store write failed: {e}")
+
+    def flush_sync(self):
+        """Commit pending writes immediately (startup and shutdown only)"""
+        if self.pending:
+            self._write(self._take_batch())
+
+    def close(self):
+        self.flush_sync()
+        with self.db_lock:
+            self.conn.close()
+
+state_store = StateStore(STATE_DB_FILE)
+
 # --- Load and Save Channel IDs ---
 server_configs = {}
 
 def load_channels():
     global server_configs
-    if not os.path.isfile(CONFIG_FILE):
-        server_configs = {"servers": {}}
+    stored = state_store.load_scope("config")
+    if stored or not os.path.isfile(CONFIG_FILE):
+        server_configs = {"servers": stored}
+        rebuild_subscriptions()
         return
     with open(CONFIG_FILE, "r") as f:
         data = json.load(f)
@@ -43,19 +153,37 @@ def load_channels():
             "event_stock_channel_id": data.get("event_stock_channel_id")
         }
         server_configs = {"servers": {"legacy": {"server_name": "Legacy Server", **old_config}}}
-        save_channels()
     else:
         server_configs = data
+    
+    # Import into the state store once; channels.json is not written again
+    logging.info(f"⚠️ Importing {CONFIG_FILE} into {STATE_DB_FILE}")
+    save_channels()
+    state_store.flush_sync()
+    rebuild_subscriptions()
 
 def save_channels():
-    with open(CONFIG_FILE, "w") as f:
-        json.dump(server_configs, f, indent=2)
+    """Queue every server config for the next state store commit"""
+    for guild_str in server_configs["servers"]:
+        save_server_config(guild_str)
+
+def save_server_config(guild_id):
+    """Queue one server config for the next state store commit"""
+    guild_str = str(guild_id)
+    config = server_configs["servers"].get(guild_str)
+    if config is not None:
+        state_store.put("config", guild_str, config)
 
-def get_server_config(guild_id):
-    """Get server configuration by guild ID"""
+def get_server_config(guild_id, create=False):
+    """Get server configuration by guild ID.
+
+    Unknown servers get a fresh default config; it is only stored in
+    server_configs when create=True, so plain lookups don't grow channels.json.
+    """
     guild_str = str(guild_id)
-    if guild_str not in server_configs["servers"]:
-        server_configs["servers"][guild_str] = {
+    config = server_configs["servers"].get(guild_str)
+    if config is None:
+        config = {
             "server_name": "Unknown Server",
             "seed_channel_id": None,
             "gear_channel_id": None,
@@ -63,24 +191,158 @@ def get_server_config(guild_id):
             "cosmetic_channel_id": None,
             "announcement_channel_id": None,
             "weather_channel_id": None,
-            "event_stock_channel_id": None
+            "event_stock_channel_id": None,
+            "countdown_mode": "edit",
+            "post_mode": "new",
+            "delivery": "bot"
         }
-    return server_configs["servers"][guild_str]
+        if create:
+            server_configs["servers"][guild_str] = config
+    return config
 
 def update_server_config(guild_id, guild_name, channel_type, channel_id):
     """Update server configuration"""
     guild_str = str(guild_id)
-    config = get_server_config(guild_id)
+    config = get_server_config(guild_id, create=True)
     config["server_name"] = guild_name
     config[f"{channel_type}_channel_id"] = channel_id
-    save_channels()
+    index_guild(guild_id)
+    save_server_config(guild_id)
+
+# --- Subscription Index ---
+# channel type -> {guild_id: channel_id}, so ticks only visit subscribed servers
+CHANNEL_TYPES = ["seed", "gear", "egg", "cosmetic", "event_stock", "announcement", "weather"]
+subscriptions = {channel_type: {} for channel_type in CHANNEL_TYPES}
+# Servers (re)subscribed since the last tick; they may need the current rotation
+# even when the upstream snapshot has not changed
+new_subscribers = {channel_type: set() for channel_type in CHANNEL_TYPES}
+
+def unindex_guild(guild_id):
+    for subscribers in subscriptions.values():
+        subscribers.pop(guild_id, None)
+    item_filters.set_guild(guild_id, None)
+
+def index_guild(guild_id):
+    """(Re)build the index entries of one server from its config"""
+    guild_id = int(guild_id)
+    unindex_guild(guild_id)
+    config = server_configs["servers"].get(str(guild_id))
+    if not config:
+        return
+    for channel_type in CHANNEL_TYPES:
+        channel_id = config.get(f"{channel_type}_channel_id")
+        if channel_id:
+            subscriptions[channel_type][guild_id] = channel_id
+            new_subscribers[channel_type].add(guild_id)
+    item_filters.set_guild(guild_id, config.get("filter"))
+
+def rebuild_subscriptions():
+    for subscribers in subscriptions.values():
+        subscribers.clear()
+    for guild_str in server_configs["servers"]:
+        # Skip the migrated "legacy" entry, it has no guild to deliver to
+        if guild_str.isdigit():
+            index_guild(guild_str)
+
+# --- Item Filters ---
+class FilterMatcher:
+    """Per-server stock filters, compiled so a rotation is matched once for all servers.
+
+    A filter is {"items": [item_id, ...], "min_price": n, "min_quantity": n}
+    (any part optional); a server gets a rotation when at least one item
+    passes it. Servers with the same filter share one compiled rule. Rules
+    that list items are indexed by item_id; threshold-only rules are checked
+    against the rotation's price/quantity frontier with a binary search.
+    """
+
+    def __init__(self):
+        self.rules = []        # rule id -> (item_ids or None, min_price, min_quantity)
+        self.rule_ids = {}     # rule -> rule id
+        self.guild_rule = {}   # guild_id -> rule id
+        self.by_item = {}      # item_id -> [rule id]
+        self.threshold_rules = []  # rule ids without an item list
+
+    @staticmethod
+    def compile_rule(spec):
+        """Canonical rule for a filter config, None when it lets everything through"""
+        if not spec:
+            return None
+        items = frozenset(spec.get("items") or ()) or None
+        rule = (items, spec.get("min_price") or 0, spec.get("min_quantity") or 0)
+        return None if rule == (None, 0, 0) else rule
+
+    def set_guild(self, guild_id, spec):
+        guild_id = int(guild_id)
+        rule = self.compile_rule(spec)
+        if rule is None:
+            self.guild_rule.pop(guild_id, None)
+            return
+        rule_id = self.rule_ids.get(rule)
+        if rule_id is None:
+            # Rules are never removed; there are only as many as distinct filters
+            rule_id = self.rule_ids[rule] = len(self.rules)
+            self.rules.append(rule)
+            if rule[0] is None:
+                self.threshold_rules.append(rule_id)
+            else:
+                for item_id in rule[0]:
+                    self.by_item.setdefault(item_id, []).append(rule_id)
+        self.guild_rule[guild_id] = rule_id
+
+    def match(self, items):
+        """Ids of the rules at least one of `items` (StockItems) passes"""
+        if not self.rules:
+            return frozenset()
+        matched = set()
+        for item in items:
+            for rule_id in self.by_item.get(item.item_id, ()):
+                _, min_price, min_quantity = self.rules[rule_id]
+                if (item.price or 0) >= min_price and item.quantity >= min_quantity:
+                    matched.add(rule_id)
+        if self.threshold_rules:
+            # prices ascending, with the best quantity among items at that price or above
+            ranked = sorted(((item.price or 0), item.quantity) for item in items)
+            prices = [price for price, _ in ranked]
+            best = [-1] * (len(ranked) + 1)  # -1: no item at this price or above
+            for i in range(len(ranked) - 1, -1, -1):
+                best[i] = max(best[i + 1], ranked[i][1])
+            for rule_id in self.threshold_rules:
+                _, min_price, min_quantity = self.rules[rule_id]
+                if best[bisect.bisect_left(prices, min_price)] >= min_quantity:
+                    matched.add(rule_id)
+        return frozenset(matched)
+
+    def allows(self, guild_id, matched):
+        rule_id = self.guild_rule.get(guild_id)
+        return rule_id is None or rule_id in matched
+
+item_filters = FilterMatcher()
+
+# Human readable summary of a filter config
+def describe_filter(spec):
+    if FilterMatcher.compile_rule(spec) is None:
+        return "every item"
+    parts = []
+    if spec.get("items"):
+        parts.append(", ".join(spec["items"]))
+    if spec.get("min_price"):
+        parts.append(f"price ≥ ${spec['min_price']:,}")
+    if spec.get("min_quantity"):
+        parts.append(f"quantity ≥ {spec['min_quantity']}")
+    return "; ".join(parts)
 
 # --- Load and Save Last Sent State ---
 def load_last_state():
     global last_state
-    if os.path.isfile(LAST_STATE_FILE):
+    stored = state_store.load_scope("last")
+    stored_weather = state_store.load_scope("weather")
+    imported = False
+    if stored or stored_weather:
+        last_state = {**stored, "weather": stored_weather}
+    elif os.path.isfile(LAST_STATE_FILE):
         with open(LAST_STATE_FILE, "r") as f:
             last_state = json.load(f)
+        imported = True
     else:
         last_state = {
             "seed": 0,
@@ -95,46 +357,157 @@ def load_last_state():
     if isinstance(last_state.get("weather"), list):
         logging.info("⚠️ Migrating weather state from list to dict")
         last_state["weather"] = {}
+    
+    if imported:
+        # Import into the state store once; last_state.json is not written again
+        logging.info(f"⚠️ Importing {LAST_STATE_FILE} into {STATE_DB_FILE}")
+        save_last_state()
+        state_store.flush_sync()
 
 def save_last_state():
-    with open(LAST_STATE_FILE, "w") as f:
-        json.dump(last_state, f, indent=2)
+    """Queue the whole last sent state for the next state store commit"""
+    for key, value in last_state.items():
+        if key != "weather":
+            state_store.put("last", key, value)
+    for key, value in last_state["weather"].items():
+        state_store.put("weather", key, value)
+
+def set_last_state(key, value):
+    last_state[key] = value
+    state_store.put("last", key, value)
+
+def set_weather_state(key, value):
+    last_state["weather"][key] = value
+    state_store.put("weather", key, value)
 
 # Webhook logging handler
 class WebhookHandler(logging.Handler):
-    def __init__(self, webhook_url):
+    """Ships log lines to a Discord webhook in batches.
+
+    emit() only appends to a bounded buffer (oldest lines are dropped when it
+    is full). A single background task packs buffered lines into <=2000 char
+    messages every `flush_interval` seconds or as soon as `batch_size` lines
+    are waiting, collapses repeats of the same line, and backs off on 429s.
+    """
+
+    def __init__(self, webhook_url, max_buffer=1000, batch_size=50, flush_interval=5.0):
         super().__init__()
         self.webhook_url = webhook_url
+        self.enabled = webhook_url.startswith("http")
         self.session = None
+        self.buffer = deque()
+        self.buffer_lock = threading.Lock()
+        self.max_buffer = max_buffer
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.task = None
+        self.loop = None
+        self.wakeup = None
+        self.stats = {"sent": 0, "dropped": 0, "collapsed": 0, "messages": 0, "rate_limited": 0}
     
-    async def send_log(self, record):
-        if not self.session:
-            self.session = aiohttp.ClientSession()
-        
+    def emit(self, record):
+        if not self.enabled:
+            return
         try:
-            message = self.format(record)
-            # Truncate message if too long for Discord
-            if len(message) > 2000:
-                message = message[:1997] + "..."
-            
-            payload = {
-                "content": f"```\n{message}\n```",
-                "username": "Bot Logger"
-            }
-            
+            line = self.format(record)
+        except Exception:
+            self.handleError(record)
+            return
+        key = (record.levelname, record.getMessage())
+        with self.buffer_lock:
+            # Collapse a line identical to the previous one into a repeat count
+            if self.buffer and self.buffer[-1][0] == key:
+                self.buffer[-1][2] += 1
+                self.stats["collapsed"] += 1
+            else:
+                if len(self.buffer) >= self.max_buffer:
+                    self.buffer.popleft()
+                    self.stats["dropped"] += 1
+                self.buffer.append([key, line, 1])
+            waiting = len(self.buffer)
+        
+        if self.task is None:
+            try:
+                self.loop = asyncio.get_running_loop()
+            except RuntimeError:
+                return  # No event loop yet, the lines wait in the buffer
+            self.wakeup = asyncio.Event()
+            self.task = self.loop.create_task(self.run())
+        if waiting >= self.batch_size and self.loop is not None:
+            self.loop.call_soon_threadsafe(self.wakeup.set)
+    
+    def _take_messages(self):
+        """Pack buffered lines into webhook-sized messages"""
+        with self.buffer_lock:
+            entries, self.buffer = list(self.buffer), deque()
+        limit = 2000 - len("```\n\n```")
+        messages, current, count, sizes = [], "", 0, []
+        for _, line, repeats in entries:
+            if repeats > 1:
+                line = f"{line} (x{repeats})"
+            if len(line) > limit:
+                line = line[:limit - 3] + "..."
+            if current and len(current) + 1 + len(line) > limit:
+                messages.append(current)
+                sizes.append(count)
+                current, count = "", 0
+            current = f"{current}\n{line}" if current else line
+            count += repeats
+        if current:
+            messages.append(current)
+            sizes.append(count)
+        return list(zip(messages, sizes))
+    
+    async def _post(self, content):
+        """POST one message, waiting out rate limits. Returns True on success"""
+        if not self.session or self.session.closed:
+            self.session = aiohttp.ClientSession()
+        payload = {"content": f"```\n{content}\n```", "username": "Bot Logger"}
+        for _ in range(5):
             async with self.session.post(self.webhook_url, json=payload) as response:
-                if response.status not in [200, 204]:
+                if response.status in (200, 204):
+                    return True
+                if response.status != 429:
                     print(f"Failed to send webhook log: {response.status}")
-        except Exception as e:
-            print(f"Webhook logging error: {e}")
+                    return False
+                self.stats["rate_limited"] += 1
+                try:
+                    retry_after = float((await response.json()).get("retry_after", 1))
+                except Exception:
+                    retry_after = float(response.headers.get("Retry-After", 1))
+            await asyncio.sleep(retry_after)
+        return False
     
-    def emit(self, record):
-        # Schedule the async send_log coroutine
-        try:
-            loop = asyncio.get_event_loop()
-            loop.create_task(self.send_log(record))
-        except:
-            pass  # Ignore if no event loop
+    async def ship(self):
+        for content, count in self._take_messages():
+            try:
+                if await self._post(content):
+                    self.stats["sent"] += count
+                    self.stats["messages"] += 1
+                else:
+                    self.stats["dropped"] += count
+            except Exception as e:
+                self.stats["dropped"] += count
+                print(f"Webhook logging error: {e}")
+    
+    async def run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self.wakeup.clear()
+            await self.ship()
+    
+    async def aclose(self):
+        """Ship what is left and close the session (logging's close() is sync)"""
+        if self.task:
+            self.task.cancel()
+            self.task = None
+        if self.enabled and self.buffer:
+            await self.ship()
+        if self.session and not self.session.closed:
+            await self.session.close()
 
 # Setup logging
 logging.basicConfig(
@@ -157,31 +530,1452 @@ logger.addHandler(webhook_handler)
 # Bot Setup
 intents = discord.Intents.default()
 intents.message_content = True
-bot = commands.Bot(command_prefix="!", intents=intents)
+
+class StockBot(commands.AutoShardedBot if RUN_MODE == "shard" else commands.Bot):
+    async def close(self):
+        await http_client.close()
+        await channel_webhooks.close()
+        await stock_archive.flush()
+        await state_store.flush()
+        await webhook_handler.aclose()
+        await super().close()
+
+# Long rate-limit waits raise discord.RateLimited so the delivery engine can
+# requeue the send instead of parking a worker on it
+shard_options = {"shard_ids": SHARD_IDS, "shard_count": SHARD_COUNT} if RUN_MODE == "shard" else {}
+bot = StockBot(command_prefix="!", intents=intents, max_ratelimit_timeout=10.0, **shard_options)
 
 load_channels()
 load_last_state()
 
 def get_channel_for_server(guild_id, channel_type):
     """Get channel ID for specific server and channel type"""
-    config = get_server_config(guild_id)
-    return config.get(f"{channel_type}_channel_id")
+    return subscriptions[channel_type].get(int(guild_id))
+
+def iter_subscribers(channel_type, only_new=False):
+    """Yield (guild, channel_id) for every server the bot is in that set this channel type.
+
+    only_new=True limits this to servers subscribed since the last full pass.
+    """
+    if only_new:
+        guild_ids = new_subscribers[channel_type]
+        entries = [(g, subscriptions[channel_type][g]) for g in guild_ids if g in subscriptions[channel_type]]
+    else:
+        entries = list(subscriptions[channel_type].items())
+    new_subscribers[channel_type] = set()
+    for guild_id, channel_id in entries:
+        guild = bot.get_guild(guild_id)
+        if guild is not None:
+            yield guild, channel_id
 
-# Lock for state access
-state_lock = asyncio.Lock()
+def uses_relative_countdown(guild_id):
+    """True when the server shows Discord relative timestamps instead of edited countdowns"""
+    return get_server_config(guild_id).get("countdown_mode", "edit") == "timestamp"
 
 # Constants
-STOCK_API_URL = "https://api.joshlei.com/v2/growagarden/stock"
-WEATHER_API_URL = "https://api.joshlei.com/v2/growagarden/weather"
+STOCK_API_URL = os.getenv("STOCK_API_URL", "https://api.joshlei.com/v2/growagarden/stock")
+WEATHER_API_URL = os.getenv("WEATHER_API_URL", "https://api.joshlei.com/v2/growagarden/weather")
 INVITE_URL = "https://discord.com/oauth2/authorize?client_id=1382419526200594583&permissions=8&integration_type=0&scope=bot"
+# Upstream API timeouts (seconds) and retries per request
+UPSTREAM_CONNECT_TIMEOUT = float(os.getenv("UPSTREAM_CONNECT_TIMEOUT", "5"))
+UPSTREAM_READ_TIMEOUT = float(os.getenv("UPSTREAM_READ_TIMEOUT", "10"))
+UPSTREAM_RETRIES = int(os.getenv("UPSTREAM_RETRIES", "2"))
+# Countdown edits allowed per minute across all servers
+EDIT_BUDGET_PER_MINUTE = int(os.getenv("EDIT_BUDGET_PER_MINUTE", "600"))
+COUNTDOWN_TICK_SECONDS = 5
+
+# Percentile over a small sample list (nearest-rank)
+def percentile(values, pct):
+    ordered = sorted(values)
+    if not ordered:
+        return 0
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+# --- Metrics ---
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9108"))  # 0 disables /metrics
+# Processes on one host need their own port: the poller (or single bot) takes
+# METRICS_PORT, a shard range METRICS_PORT + 1 + its first shard id
+if METRICS_PORT and RUN_MODE == "shard":
+    METRICS_PORT += 1 + min(SHARD_IDS or [0])
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+class Histogram:
+    """Prometheus-style cumulative histogram that also keeps recent samples"""
+
+    def __init__(self, buckets=LATENCY_BUCKETS, samples=500):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+        self.recent = deque(maxlen=samples)
+
+    def observe(self, value):
+        self.sum += value
+        self.count += 1
+        self.recent.append(value)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+    def quantile(self, pct):
+        return percentile(self.recent, pct) if self.recent else None
+
+class Metrics:
+    """Counters, histograms and scrape-time gauges rendered as Prometheus text"""
+
+    def __init__(self, prefix="stockbot"):
+        self.prefix = prefix
+        self.counters = {}    # (name, labels) -> value
+        self.histograms = {}  # (name, labels) -> Histogram
+        self.gauges = {}      # name -> callable returning {labels: value}
+        self.help = {}
+
+    @staticmethod
+    def _labels(labels):
+        return tuple(sorted(labels.items()))
+
+    def inc(self, name, value=1, **labels):
+        key = (name, self._labels(labels))
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    def histogram(self, name, **labels):
+        key = (name, self._labels(labels))
+        hist = self.histograms.get(key)
+        if hist is None:
+            hist = self.histograms[key] = Histogram()
+        return hist
+
+    def observe(self, name, value, **labels):
+        self.histogram(name, **labels).observe(value)
+
+    def gauge(self, name, collect, help_text=""):
+        self.gauges[name] = collect
+        self.help[name] = help_text
+
+    @contextmanager
+    def track_loop(self, name, loop):
+        """Time one tasks.loop iteration and count it as an overrun when it
+        takes longer than the loop's interval"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - start
+            self.observe("loop_duration_seconds", duration, loop=name)
+            interval = (loop.hours or 0) * 3600 + (loop.minutes or 0) * 60 + (loop.seconds or 0)
+            if interval and duration > interval:
+                self.inc("loop_overruns_total", loop=name)
+
+    def _format(self, name, labels, extra=()):
+        pairs = list(labels) + list(extra)
+        if not pairs:
+            return f"{self.prefix}_{name}"
+        inner = ",".join(f'{k}="{v}"' for k, v in pairs)
+        return f"{self.prefix}_{name}{{{inner}}}"
+
+    def render(self):
+        lines = []
+        typed = set()
+        for (name, labels), value in sorted(self.counters.items()):
+            if name not in typed:
+                lines.append(f"# TYPE {self.prefix}_{name} counter")
+                typed.add(name)
+            lines.append(f"{self._format(name, labels)} {value}")
+        for (name, labels), hist in sorted(self.histograms.items(), key=lambda kv: kv[0]):
+            if name not in typed:
+                lines.append(f"# TYPE {self.prefix}_{name} histogram")
+                typed.add(name)
+            cumulative = 0
+            for bound, count in zip(hist.buckets, hist.counts):
+                cumulative += count
+                lines.append(f"{self._format(name + '_bucket', labels, [('le', bound)])} {cumulative}")
+            lines.append(f"{self._format(name + '_bucket', labels, [('le', '+Inf')])} {hist.count}")
+            lines.append(f"{self._format(name + '_sum', labels)} {hist.sum}")
+            lines.append(f"{self._format(name + '_count', labels)} {hist.count}")
+        for name, collect in sorted(self.gauges.items()):
+            if self.help.get(name):
+                lines.append(f"# HELP {self.prefix}_{name} {self.help[name]}")
+            lines.append(f"# TYPE {self.prefix}_{name} gauge")
+            for labels, value in collect().items():
+                lines.append(f"{self._format(name, labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+metrics = Metrics()
+
+async def probe_event_loop_lag(interval=0.5):
+    """Record how late a short sleep wakes up; a busy loop shows up as lag"""
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        metrics.observe("event_loop_lag_seconds", time.perf_counter() - start - interval)
+
+_metrics_runner = None
+
+async def start_metrics_server():
+    """Serve /metrics and start the lag probe (once per process)"""
+    global _metrics_runner
+    if _metrics_runner is not None or not METRICS_PORT:
+        return
+    async def handle_metrics(request):
+        return web.Response(text=metrics.render(), content_type="text/plain", charset="utf-8")
+    app = web.Application()
+    app.router.add_get("/metrics", handle_metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, METRICS_HOST, METRICS_PORT).start()
+    except OSError as e:
+        # Metrics are optional; a taken port must not stop the bot
+        logging.error(f"⚠️ Cannot serve metrics on {METRICS_HOST}:{METRICS_PORT}: {e}")
+        await runner.cleanup()
+        return
+    _metrics_runner = runner
+    asyncio.create_task(probe_event_loop_lag())
+    logging.info(f"📈 Metrics on http://{METRICS_HOST}:{METRICS_PORT}/metrics")
+
+# --- Shared Upstream HTTP Client ---
+class CircuitOpen(Exception):
+    """Raised instead of calling an upstream endpoint whose breaker is open"""
+
+    def __init__(self, url, retry_in):
+        super().__init__(f"circuit open for {url}, next probe in {retry_in:.0f}s")
+        self.url = url
+        self.retry_in = retry_in
+
+class CircuitBreaker:
+    """Stops calling an endpoint after `threshold` consecutive failures.
+
+    While open every call fails fast. After `reset_timeout` seconds one probe
+    is let through (half-open): success closes the breaker, failure opens it
+    again for twice as long, up to `max_timeout`.
+    """
+
+    def __init__(self, threshold=5, reset_timeout=15, max_timeout=300):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.max_timeout = max_timeout
+        self.failures = 0
+        self.timeout = reset_timeout
+        self.opened_at = None
+        self.probing = False
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if self.probing or time.monotonic() - self.opened_at >= self.timeout:
+            return "half_open"
+        return "open"
+
+    def retry_in(self):
+        return max(0.0, self.opened_at + self.timeout - time.monotonic()) if self.opened_at else 0.0
+
+    def allow(self):
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and not self.probing:
+            self.probing = True
+            return True
+        return False
+
+    def record_success(self):
+        self.failures = 0
+        self.timeout = self.reset_timeout
+        self.opened_at = None
+        self.probing = False
+
+    def release_probe(self):
+        """Let another call probe, when this one ended without a result"""
+        self.probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self.probing:
+            self.timeout = min(self.max_timeout, self.timeout * 2)
+        if self.probing or self.failures >= self.threshold:
+            self.opened_at = time.monotonic()
+        self.probing = False
+
+class RetryBudget:
+    """Caps retries at `ratio` of recent requests (plus a small floor), so a
+    failing upstream sees at most that much extra load"""
+
+    def __init__(self, ratio=0.2, floor=5):
+        self.ratio = ratio
+        self.floor = floor
+        self.tokens = floor
+
+    def on_request(self):
+        self.tokens = min(self.floor + 10, self.tokens + self.ratio)
+
+    def try_spend(self):
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+class UpstreamClient:
+    """One pooled keep-alive session for every upstream API call.
+
+    Remembers the ETag / Last-Modified of each URL and sends conditional
+    requests, so an unchanged response costs a 304 and reuses the JSON we
+    already parsed. Requests have explicit connect/read timeouts; timeouts,
+    connection errors, 5xx and 429 are retried with jittered backoff while
+    the retry budget allows, and each URL has a circuit breaker.
+    """
+
+    def __init__(self, pool_size=20, keepalive=60, retries=UPSTREAM_RETRIES, backoff=0.5):
+        self.pool_size = pool_size
+        self.keepalive = keepalive
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = aiohttp.ClientTimeout(
+            total=None, sock_connect=UPSTREAM_CONNECT_TIMEOUT, sock_read=UPSTREAM_READ_TIMEOUT
+        )
+        self.session = None
+        self.validators = {}  # url -> {"etag": ..., "last_modified": ...}
+        self.cached = {}      # url -> last parsed JSON body
+        self.breakers = {}    # url -> CircuitBreaker
+        self.retry_budget = RetryBudget()
+        self.stats = {
+            "requests": 0,
+            "not_modified": 0,
+            "errors": 0,
+            "retries": 0,
+            "short_circuited": 0,
+            "connections_created": 0,
+            "connections_reused": 0,
+            "in_flight": 0
+        }
+
+    def _trace_config(self):
+        trace = aiohttp.TraceConfig()
+
+        async def on_create(session, ctx, params):
+            self.stats["connections_created"] += 1
+
+        async def on_reuse(session, ctx, params):
+            self.stats["connections_reused"] += 1
+
+        trace.on_connection_create_end.append(on_create)
+        trace.on_connection_reuseconn.append(on_reuse)
+        return trace
+
+    def get_session(self):
+        """Create the session lazily, on the running event loop"""
+        if self.session is None or self.session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.pool_size,
+                keepalive_timeout=self.keepalive,
+                ttl_dns_cache=300
+            )
+            self.session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=self.timeout,
+                trace_configs=[self._trace_config()]
+            )
+        return self.session
+
+    def breaker(self, url):
+        breaker = self.breakers.get(url)
+        if breaker is None:
+            breaker = self.breakers[url] = CircuitBreaker()
+        return breaker
+
+    async def get_json(self, url):
+        """GET a JSON endpoint. Returns (status, data).
+
+        status is 200 for a fresh body, 304 when the cached body is still
+        valid (data is the cached body), anything else means data is None.
+        Raises CircuitOpen without touching the network while the URL's
+        breaker is open, and the last error once retries are exhausted.
+        """
+        breaker = self.breaker(url)
+        self.retry_budget.on_request()
+        attempt = 0
+        while True:
+            if not breaker.allow():
+                self.stats["short_circuited"] += 1
+                raise CircuitOpen(url, breaker.retry_in())
+            try:
+                status, data = await self._get_once(url)
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+                # ValueError: a truncated or malformed JSON body
+                status, data, error = None, None, e
+            except BaseException:
+                # Cancelled, or a bug; never leave the half-open probe taken
+                breaker.release_probe()
+                raise
+            else:
+                error = None
+            retryable = error is not None or status == 429 or status >= 500
+            if not retryable:
+                # 4xx other than 429 means the request is wrong, not the upstream
+                breaker.record_success()
+                return status, data
+            breaker.record_failure()
+            if attempt >= self.retries or breaker.state != "closed" or not self.retry_budget.try_spend():
+                if error is not None:
+                    raise error
+                return status, data
+            attempt += 1
+            self.stats["retries"] += 1
+            # Full jitter: sleep a random slice of the exponential backoff
+            await asyncio.sleep(random.uniform(0, self.backoff * 2 ** attempt))
+
+    async def _get_once(self, url):
+        session = self.get_session()
+        headers = {}
+        validator = self.validators.get(url)
+        if validator and url in self.cached:
+            if validator.get("etag"):
+                headers["If-None-Match"] = validator["etag"]
+            if validator.get("last_modified"):
+                headers["If-Modified-Since"] = validator["last_modified"]
+
+        self.stats["requests"] += 1
+        self.stats["in_flight"] += 1
+        feed = url.rstrip("/").rsplit("/", 1)[-1]
+        status = "error"
+        start = time.perf_counter()
+        try:
+            async with session.get(url, headers=headers) as r:
+                status = r.status
+                if r.status == 304 and url in self.cached:
+                    self.stats["not_modified"] += 1
+                    return 304, self.cached[url]
+                if r.status == 200 and r.content_type == 'application/json':
+                    data = await r.json()
+                    self.cached[url] = data
+                    self.validators[url] = {
+                        "etag": r.headers.get("ETag"),
+                        "last_modified": r.headers.get("Last-Modified")
+                    }
+                    return 200, data
+                text = await r.text()
+                self.stats["errors"] += 1
+                logging.warning(f"⚠️ {url} returned {r.status}: {text[:200]}")
+                return r.status, None
+        except Exception:
+            self.stats["errors"] += 1
+            raise
+        finally:
+            self.stats["in_flight"] -= 1
+            metrics.observe("upstream_request_seconds", time.perf_counter() - start, feed=feed)
+            metrics.inc("upstream_responses_total", feed=feed, status=status)
+
+    async def close(self):
+        if self.session and not self.session.closed:
+            await self.session.close()
+
+http_client = UpstreamClient()
+metrics.gauge(
+    "upstream_pool",
+    lambda: {(("stat", key),): value for key, value in http_client.stats.items()},
+    "Upstream HTTP pool counters"
+)
+metrics.gauge(
+    "upstream_circuit_open",
+    lambda: {
+        (("feed", url.rstrip("/").rsplit("/", 1)[-1]),): int(breaker.state != "closed")
+        for url, breaker in http_client.breakers.items()
+    },
+    "1 while the upstream circuit breaker of a feed is open or probing"
+)
+
+# --- Upstream Snapshot Cache ---
+class SnapshotCache:
+    """Shares upstream snapshots between the pollers and slash commands.
+
+    Concurrent requests for the same URL share one in-flight fetch. get()
+    answers from memory while a snapshot is younger than `ttl`, serves it
+    stale (and revalidates in the background) up to `stale_ttl`, and only
+    waits on the network after that. If that fetch fails, or the upstream
+    circuit is open, the last good snapshot is served whatever its age.
+    The pollers call refresh(), which keeps the cache warm.
+
+    A follower (a shard) never fetches: it only answers with what the
+    poller process stored, and its snapshots age until the poller says
+    they are still current.
+    """
+
+    def __init__(self, client, ttl=30, stale_ttl=300, follower=False):
+        self.client = client
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.follower = follower
+        self.entries = {}   # url -> (fetched_at, status, data)
+        self.inflight = {}  # url -> Future
+        self.failed = set()  # urls whose last fetch failed
+        self.stats = {"hits": 0, "stale_hits": 0, "last_good": 0, "fetches": 0, "joined": 0}
+
+    async def _fetch(self, url):
+        try:
+            status, data = await self.client.get_json(url)
+        except Exception:
+            self.failed.add(url)
+            raise
+        if data is None:
+            self.failed.add(url)
+        else:
+            self.entries[url] = (time.monotonic(), status, data)
+            self.failed.discard(url)
+        return status, data
+
+    def _start_fetch(self, url):
+        future = self.inflight.get(url)
+        if future is not None:
+            self.stats["joined"] += 1
+            return future
+        self.stats["fetches"] += 1
+        future = asyncio.ensure_future(self._fetch(url))
+        self.inflight[url] = future
+        future.add_done_callback(lambda f: self.inflight.pop(url, None))
+        return future
+
+    async def refresh(self, url):
+        """Fetch now (joining any fetch already in flight). Returns (status, data)"""
+        return await asyncio.shield(self._start_fetch(url))
+
+    def _log_background_error(self, future):
+        if not future.cancelled() and future.exception():
+            logging.warning(f"⚠️ Background refresh failed: {future.exception()}")
+
+    async def get(self, url):
+        """Return (status, data), answering from the cache whenever allowed.
+
+        Use is_stale() afterwards to tell whether the answer may be out of
+        date because upstream is failing.
+        """
+        entry = self.entries.get(url)
+        if self.follower:
+            if entry is None:
+                return None, None
+            self.stats["hits" if time.monotonic() - entry[0] < self.stale_ttl else "last_good"] += 1
+            return entry[1], entry[2]
+        if entry:
+            age = time.monotonic() - entry[0]
+            if age < self.ttl:
+                self.stats["hits"] += 1
+                return entry[1], entry[2]
+            circuit_open = self.client.breaker(url).state == "open"
+            if age < self.stale_ttl or circuit_open:
+                self.stats["stale_hits"] += 1
+                if not circuit_open:
+                    self._start_fetch(url).add_done_callback(self._log_background_error)
+                return entry[1], entry[2]
+        try:
+            status, data = await self.refresh(url)
+        except Exception:
+            if entry is None:
+                raise
+            status, data = None, None
+        if data is None and entry is not None:
+            self.stats["last_good"] += 1
+            return entry[1], entry[2]
+        return status, data
+
+    def is_stale(self, url):
+        """True when the cached snapshot may be out of date: it is past
+        stale_ttl, the last refresh failed, or the upstream circuit is not closed"""
+        age = self.age(url)
+        if age is None:
+            return False
+        breaker = self.client.breakers.get(url)
+        return age >= self.stale_ttl or url in self.failed or (breaker is not None and breaker.state != "closed")
+
+    def store(self, url, status, data):
+        """Insert a snapshot fetched elsewhere (the poller process)"""
+        self.entries[url] = (time.monotonic(), status, data)
+
+    def touch(self, url):
+        """Mark the stored snapshot as current again (the poller got a 304). Returns it, or None"""
+        entry = self.entries.get(url)
+        if entry is None:
+            return None
+        self.entries[url] = (time.monotonic(), 304, entry[2])
+        return 304, entry[2]
+
+    def age(self, url):
+        entry = self.entries.get(url)
+        return None if entry is None else time.monotonic() - entry[0]
+
+snapshot_cache = SnapshotCache(http_client, follower=RUN_MODE == "shard")
+
+# --- Fan-out Delivery ---
+class TokenBucket:
+    """Simple token bucket: `rate` requests every `per` seconds"""
+
+    def __init__(self, rate, per):
+        self.rate = rate
+        self.per = per
+        self.tokens = rate
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate / self.per)
+        self.updated = now
+
+    def penalize(self, retry_after):
+        """Drain the bucket after Discord told us to back off"""
+        self.tokens = 0
+        self.blocked_until = max(self.blocked_until, time.monotonic() + retry_after)
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            if self.blocked_until > now:
+                await asyncio.sleep(self.blocked_until - now)
+                continue
+            self._refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) * self.per / self.rate)
+
+class DeliveryJob:
+    """One message to send to one channel as part of a fan-out"""
+
+    def __init__(self, guild, channel_id, kwargs, on_sent=None, partial=False, on_failed=None,
+                 edit_message_id=None, edit_webhook_id=None, pin=False):
+        self.guild = guild
+        self.channel_id = channel_id
+        self.kwargs = kwargs
+        self.on_sent = on_sent
+        self.on_failed = on_failed  # called when the job is dropped without being sent
+        # Edit this message instead of sending; falls back to a send if it was deleted
+        self.edit_message_id = edit_message_id
+        self.edit_webhook_id = edit_webhook_id  # webhook that sent that message, None if the bot did
+        self.pin = pin  # pin the message when it had to be sent
+        # partial=True sends through a PartialMessageable (DM channels are not cached)
+        self.partial = partial
+        self.attempts = 0
+
+    @property
+    def where(self):
+        return self.guild.name if self.guild else "DMs"
+
+class DeliveryEngine:
+    """Sends one event to many channels concurrently.
+
+    Concurrency is capped by a semaphore, sends respect a global bucket and a
+    per-channel bucket mirroring Discord's message route limits, and failed
+    sends are retried from a priority queue ordered by (due time, attempts).
+    """
+
+    def __init__(self, max_concurrency=25, global_rate=45, channel_rate=5, channel_per=5.0,
+                 max_attempts=3, samples=5000):
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.global_bucket = TokenBucket(global_rate, 1.0)
+        self.channel_rate = channel_rate
+        self.channel_per = channel_per
+        self.channel_buckets = {}
+        self.max_attempts = max_attempts
+        self.deliver_times = deque(maxlen=samples)
+        self.stats = {"sent": 0, "failed": 0, "retried": 0, "rate_limited": 0}
+        self._seq = 0
+
+    def _channel_bucket(self, channel_id):
+        bucket = self.channel_buckets.get(channel_id)
+        if bucket is None:
+            if len(self.channel_buckets) > 20000:
+                # Drop buckets that have fully refilled, they carry no state
+                now = time.monotonic()
+                self.channel_buckets = {
+                    cid: b for cid, b in self.channel_buckets.items()
+                    if now - b.updated < b.per or b.blocked_until > now
+                }
+            bucket = TokenBucket(self.channel_rate, self.channel_per)
+            self.channel_buckets[channel_id] = bucket
+        return bucket
+
+    async def _attempt(self, job, started, retry_queue):
+        """Try one send. Returns True when the job is finished (sent or dropped)"""
+        ch = bot.get_partial_messageable(job.channel_id) if job.partial else bot.get_channel(job.channel_id)
+        if ch is None:
+            return self._fail(job)
+        job.attempts += 1
+        hook = None
+        if job.edit_message_id and job.edit_webhook_id is not None:
+            # Only the webhook that sent a message can edit it
+            hook = channel_webhooks.get(job.channel_id)
+            if hook is None or hook.id != job.edit_webhook_id:
+                hook, job.edit_message_id = None, None  # That webhook is gone; post a new message
+        async with self.semaphore:
+            # New messages go through the server's chosen route, edits through the one that sent them.
+            # Creating a missing webhook is a bot request, so it is capped and charged like a send.
+            if not job.edit_message_id and job.guild is not None and not job.partial and uses_webhook_delivery(job.guild.id):
+                try:
+                    hook = await channel_webhooks.ensure(ch, self.global_bucket)
+                except Exception:
+                    # Post as the bot rather than failing the whole fan-out
+                    logging.exception(f"⚠️ Webhook lookup for {job.channel_id} in {job.where} failed")
+            # Webhook requests have their own limits and leave the bot's global bucket alone
+            bucket = channel_webhooks.bucket(hook) if hook else self._channel_bucket(job.channel_id)
+            await bucket.acquire()
+            if hook is None:
+                await self.global_bucket.acquire()
+            request_start = time.perf_counter()
+            try:
+                msg = await (self._deliver_webhook(hook, ch, job) if hook else self._deliver(ch, job))
+            except discord.RateLimited as e:
+                self.stats["rate_limited"] += 1
+                metrics.inc("discord_rate_limited_total", op="send")
+                bucket.penalize(e.retry_after)
+                return self._requeue(job, e.retry_after, retry_queue)
+            except (discord.Forbidden, discord.NotFound) as e:
+                logging.warning(f"⚠️ Cannot send to {job.channel_id} in {job.where}: {e}")
+                return self._fail(job)
+            except discord.HTTPException as e:
+                if e.status == 429:
+                    metrics.inc("discord_rate_limited_total", op="send")
+                if e.status == 429 or e.status >= 500:
+                    return self._requeue(job, 2 ** job.attempts, retry_queue)
+                logging.warning(f"⚠️ Send to {job.channel_id} in {job.where} failed: {e}")
+                return self._fail(job)
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                return self._requeue(job, 2 ** job.attempts, retry_queue)
+            except Exception:
+                logging.exception(f"⚠️ Send to {job.channel_id} in {job.where} raised an unexpected error")
+                return self._fail(job)
+            finally:
+                metrics.observe("discord_request_seconds", time.perf_counter() - request_start, op="send")
+
+        self.stats["sent"] += 1
+        metrics.inc("discord_requests_total", op="send")
+        self.deliver_times.append(time.monotonic() - started)
+        metrics.observe("time_to_deliver_seconds", time.monotonic() - started)
+        if job.on_sent:
+            try:
+                job.on_sent(msg)
+            except Exception:
+                # The message is out; a bookkeeping bug must not abort the fan-out
+                logging.exception(f"⚠️ Recording the send to {job.channel_id} in {job.where} failed")
+        return True
+
+    async def _deliver(self, ch, job):
+        if job.edit_message_id:
+            message = ch.get_partial_message(job.edit_message_id)
+            try:
+                return await message.edit(**job.kwargs) or message
+            except discord.NotFound:
+                job.edit_message_id = None  # Deleted; post a new one instead
+        msg = await ch.send(**job.kwargs)
+        if job.pin:
+            try:
+                await msg.pin()
+            except discord.HTTPException:
+                pass  # No Manage Messages permission; the message works unpinned too
+        return msg
+
+    async def _deliver_webhook(self, hook, ch, job):
+        try:
+            return await channel_webhooks.execute(hook, job)
+        except discord.NotFound as e:
+            if e.code != UNKNOWN_WEBHOOK:
+                raise
+        logging.info(f"🔁 Webhook in {job.channel_id} ({job.where}) was deleted, creating a new one")
+        channel_webhooks.forget(job.channel_id)
+        channel_webhooks.stats["recreated"] += 1
+        hook = await channel_webhooks.ensure(ch, self.global_bucket)
+        return await (channel_webhooks.execute(hook, job) if hook else self._deliver(ch, job))
+
+    def _fail(self, job):
+        self.stats["failed"] += 1
+        if job.on_failed:
+            job.on_failed()
+        return True
+
+    def _requeue(self, job, delay, retry_queue):
+        if job.attempts >= self.max_attempts:
+            logging.warning(f"⚠️ Giving up on {job.channel_id} in {job.where} after {job.attempts} attempts")
+            return self._fail(job)
+        self.stats["retried"] += 1
+        self._seq += 1
+        heapq.heappush(retry_queue, (time.monotonic() + delay, job.attempts, self._seq, job))
+        return False
+
+    async def fan_out(self, label, jobs):
+        """Deliver all jobs, retrying failures, and log time-to-deliver"""
+        if not jobs:
+            return 0
+        started = time.monotonic()
+        sent_before = self.stats["sent"]
+        retry_queue = []
+        await asyncio.gather(*(self._attempt(job, started, retry_queue) for job in jobs))
+
+        while retry_queue:
+            due = retry_queue[0][0]
+            delay = due - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            now = time.monotonic()
+            ready = []
+            while retry_queue and retry_queue[0][0] <= now:
+                ready.append(heapq.heappop(retry_queue)[3])
+            await asyncio.gather(*(self._attempt(job, started, retry_queue) for job in ready))
+
+        sent = self.stats["sent"] - sent_before
+        recent = list(self.deliver_times)[-sent:] if sent else []
+        if recent:
+            logging.info(
+                f"📬 Delivered {label} to {sent}/{len(jobs)} channels in {time.monotonic() - started:.1f}s "
+                f"(p50 {percentile(recent, 50):.2f}s, p99 {percentile(recent, 99):.2f}s)"
+            )
+        return sent
+
+    def latency_summary(self):
+        """Return (p50, p99) time-to-deliver in seconds, or None"""
+        if not self.deliver_times:
+            return None
+        return percentile(self.deliver_times, 50), percentile(self.deliver_times, 99)
+
+delivery = DeliveryEngine()
+
+# --- Delivery Claims ---
+class ClaimTable:
+    """Compare-and-set reservations on "this key has posted this value".
+
+    claim() checks the committed value and any pending claim and records a
+    new claim in one synchronous step, so no other coroutine can interleave
+    and no lock is held while the message is sent. The sender then calls
+    commit() once the message is out, which persists the value, or
+    release() when the send failed. Pending claims are never persisted: a
+    crash before commit leaves the key unclaimed for the next run, and a
+    claim whose sender never reports back (cancelled task) lapses after
+    `ttl` seconds.
+    """
+
+    def __init__(self, name, load, store, newer=False, ttl=600):
+        self.name = name
+        self.load = load    # key -> committed value
+        self.store = store  # (key, value) -> None, persists a committed value
+        self.newer = newer  # True: only values greater than the committed one can be claimed
+        self.ttl = ttl
+        self.pending = {}   # key -> (value, claimed_at)
+        self.stats = {"claimed": 0, "contended": 0, "committed": 0, "released": 0}
+
+    def _accepts(self, current, value):
+        return value > current if self.newer else value != current
+
+    def claim(self, key, value):
+        """Reserve (key, value). Returns False if it is already posted or being posted"""
+        now = time.monotonic()
+        pending = self.pending.get(key)
+        if pending is not None and pending[0] == value and now - pending[1] < self.ttl:
+            self.stats["contended"] += 1
+            return False
+        if not self._accepts(self.load(key), value):
+            return False
+        self.pending[key] = (value, now)
+        self.stats["claimed"] += 1
+        return True
+
+    def commit(self, key, value):
+        if self.pending.get(key, (None,))[0] == value:
+            del self.pending[key]
+        self.store(key, value)
+        self.stats["committed"] += 1
+
+    def release(self, key, value):
+        if self.pending.get(key, (None,))[0] == value:
+            del self.pending[key]
+            self.stats["released"] += 1
+
+# Who has posted which stock rotation / weather occurrence
+stock_claims = ClaimTable("stock", lambda key: last_state.get(key, 0), set_last_state, newer=True)
+weather_claims = ClaimTable("weather", lambda key: last_state["weather"].get(key, 0), set_weather_state)
+metrics.gauge(
+    "delivery_claims",
+    lambda: {
+        (("table", table.name), ("stat", stat)): value
+        for table in (stock_claims, weather_claims)
+        for stat, value in {**table.stats, "pending": len(table.pending)}.items()
+    },
+    "Claim table counters and pending claims"
+)
+
+# --- Live Boards ---
+class BoardRegistry:
+    """The one pinned message per (server, channel type) used in live-board mode.
+
+    Message ids and a hash of what each board currently shows are kept in
+    the state store, so a rotation becomes an edit of a known message and an
+    edit that would not change anything is skipped.
+    """
+
+    def __init__(self):
+        self.boards = {}  # "guild_channeltype" -> {"channel_id": ..., "message_id": ..., "hash": ...}
+        self.stats = {"edits": 0, "skipped": 0}
+
+    def load(self):
+        self.boards = state_store.load_scope("board")
+
+    def get(self, guild_id, channel_type, channel_id):
+        """The board in this channel, None if there is none (or the channel was changed)"""
+        entry = self.boards.get(f"{guild_id}_{channel_type}")
+        return entry if entry and entry["channel_id"] == channel_id else None
+
+    def record(self, guild_id, channel_type, channel_id, message_id, content_hash, webhook_id=None):
+        key = f"{guild_id}_{channel_type}"
+        entry = {"channel_id": channel_id, "message_id": message_id, "hash": content_hash, "webhook_id": webhook_id}
+        if self.boards.get(key) != entry:
+            self.boards[key] = entry
+            state_store.put("board", key, entry)
+
+boards = BoardRegistry()
+boards.load()
+
+def uses_live_board(guild_id):
+    """True when the server keeps one message per channel, edited in place"""
+    return get_server_config(guild_id).get("post_mode", "new") == "board"
+
+# Hash of the embeds a message would show
+def embed_hash(kwargs):
+    embeds = kwargs.get("embeds") or [kwargs["embed"]]
+    return hashlib.blake2b(
+        json.dumps([e.to_dict() for e in embeds], sort_keys=True, default=str).encode(), digest_size=16
+    ).hexdigest()
+
+def board_job(guild, channel_type, channel_id, kwargs, content_hash, on_sent, on_failed=None):
+    """DeliveryJob that updates the server's board for channel_type, or posts and pins it.
+
+    Returns None when the board already shows this content; on_sent is then
+    called right away with the board message.
+    """
+    entry = boards.get(guild.id, channel_type, channel_id)
+    if entry and entry["hash"] == content_hash:
+        boards.stats["skipped"] += 1
+        message = discord.Object(id=entry["message_id"])
+        message.webhook_id = entry.get("webhook_id")
+        on_sent(message)
+        return None
+
+    def record(msg):
+        boards.record(guild.id, channel_type, channel_id, msg.id, content_hash, getattr(msg, "webhook_id", None))
+        on_sent(msg)
 
-# Active events tracking
+    if entry:
+        boards.stats["edits"] += 1
+    return DeliveryJob(
+        guild, channel_id, kwargs, record, on_failed=on_failed,
+        edit_message_id=entry["message_id"] if entry else None,
+        edit_webhook_id=entry.get("webhook_id") if entry else None, pin=True
+    )
+
+metrics.gauge(
+    "live_boards",
+    lambda: {(("stat", "boards"),): len(boards.boards), **{(("stat", k),): v for k, v in boards.stats.items()}},
+    "Live board messages, edits queued and edits skipped as unchanged"
+)
+
+# --- Channel Webhook Delivery ---
+WEBHOOK_NAME = "Stock Updates"
+WEBHOOK_CREATE_RETRY = 3600  # seconds before trying again where creating a webhook failed
+UNKNOWN_WEBHOOK = 10015      # Discord error code of a deleted webhook
+
+class ChannelWebhooks:
+    """One webhook per channel for servers that post through webhooks.
+
+    Executing a webhook is authenticated by the webhook token instead of the
+    bot token, so a large fan-out does not use up the bot's global request
+    limit that slash command responses share. Every webhook gets its own
+    token bucket, requests go over one pooled session, and the webhook
+    id/token per channel are kept in the state store. A webhook deleted in
+    Discord is forgotten and created again on the next send.
+    """
+
+    def __init__(self, rate=5, per=2.0, pool_size=50):
+        self.rate = rate
+        self.per = per
+        self.pool_size = pool_size
+        self.session = None
+        self.hooks = {}          # channel_id -> {"id": ..., "token": ...}
+        self.webhooks = {}       # channel_id -> discord.Webhook
+        self.buckets = {}        # webhook id -> TokenBucket
+        self.creating = {}       # channel_id -> task creating its webhook
+        self.create_failed = {}  # channel_id -> when creating one last failed
+        self.stats = {"created": 0, "recreated": 0, "sent": 0, "edited": 0}
+
+    def load(self):
+        self.hooks = {int(cid): entry for cid, entry in state_store.load_scope("webhook").items()}
+
+    def _session(self):
+        if self.session is None or self.session.closed:
+            self.session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.pool_size, keepalive_timeout=60)
+            )
+        return self.session
+
+    def get(self, channel_id):
+        """The stored webhook of a channel, or None"""
+        hook = self.webhooks.get(channel_id)
+        if hook is None and channel_id in self.hooks:
+            entry = self.hooks[channel_id]
+            # client=bot binds sent messages to the bot's state, so they can still be pinned
+            hook = discord.Webhook.partial(entry["id"], entry["token"], session=self._session(), client=bot)
+            self.webhooks[channel_id] = hook
+        return hook
+
+    def bucket(self, hook):
+        bucket = self.buckets.get(hook.id)
+        if bucket is None:
+            bucket = self.buckets[hook.id] = TokenBucket(self.rate, self.per)
+        return bucket
+
+    async def ensure(self, channel, throttle=None):
+        """The channel's webhook, created when missing. None if it cannot have one.
+
+        Creating a webhook is a bot-token request; throttle is the bucket it
+        is charged to (the delivery engine's global bucket).
+        """
+        hook = self.get(channel.id)
+        if hook is not None or not hasattr(channel, "create_webhook"):
+            return hook
+        failed_at = self.create_failed.get(channel.id)
+        if failed_at is not None and time.monotonic() - failed_at < WEBHOOK_CREATE_RETRY:
+            return None
+        # Concurrent sends to one channel share a single creation
+        task = self.creating.get(channel.id)
+        if task is None:
+            task = asyncio.ensure_future(self._create(channel, throttle))
+            self.creating[channel.id] = task
+            task.add_done_callback(lambda _: self.creating.pop(channel.id, None))
+        return await task
+
+    async def _create(self, channel, throttle):
+        try:
+            if throttle is not None:
+                await throttle.acquire()
+            created = await channel.create_webhook(name=WEBHOOK_NAME, reason="Stock and weather posts")
+        except Exception as e:
+            if isinstance(e, discord.RateLimited) and throttle is not None:
+                throttle.penalize(e.retry_after)
+            # Forbidden, RateLimited, transport errors: post as the bot until the retry window passes
+            self.create_failed[channel.id] = time.monotonic()
+            logging.warning(f"⚠️ Cannot create a webhook in {channel.id}, posting as the bot: {e}")
+            return None
+        self.create_failed.pop(channel.id, None)
+        self.hooks[channel.id] = {"id": created.id, "token": created.token}
+        state_store.put("webhook", str(channel.id), self.hooks[channel.id])
+        self.stats["created"] += 1
+        return self.get(channel.id)
+
+    def forget(self, channel_id):
+        """Drop a webhook that no longer exists"""
+        entry = self.hooks.pop(channel_id, None)
+        self.webhooks.pop(channel_id, None)
+        if entry is not None:
+            self.buckets.pop(entry["id"], None)
+            state_store.delete("webhook", str(channel_id))
+
+    async def execute(self, hook, job):
+        """Edit or send the job's message through a webhook (pinning new ones if asked)"""
+        if job.edit_message_id:
+            try:
+                msg = await hook.edit_message(job.edit_message_id, **job.kwargs)
+                self.stats["edited"] += 1
+                return msg
+            except discord.NotFound as e:
+                if e.code == UNKNOWN_WEBHOOK:
+                    raise
+                job.edit_message_id = None  # Deleted, or posted by the bot; post a new one
+        msg = await hook.send(
+            wait=True, username=bot.user.display_name, avatar_url=bot.user.display_avatar.url, **job.kwargs
+        )
+        self.stats["sent"] += 1
+        if job.pin:
+            try:
+                await msg.pin()
+            except discord.HTTPException:
+                pass
+        return msg
+
+    async def close(self):
+        if self.session and not self.session.closed:
+            await self.session.close()
+
+channel_webhooks = ChannelWebhooks()
+channel_webhooks.load()
+
+def uses_webhook_delivery(guild_id):
+    """True when the server posts stock and weather through channel webhooks"""
+    return get_server_config(guild_id).get("delivery", "bot") == "webhook"
+
+metrics.gauge(
+    "channel_webhooks",
+    lambda: {
+        (("stat", "webhooks"),): len(channel_webhooks.hooks),
+        **{(("stat", k),): v for k, v in channel_webhooks.stats.items()}
+    },
+    "Channel webhooks stored, created, recreated after deletion, and messages sent/edited through them"
+)
+
+# --- Snapshot Model ---
+# Events without an end time are forgotten after this long
+WEATHER_FALLBACK_TTL = 3600
+
+def _as_number(value, default=None):
+    return value if isinstance(value, (int, float)) and not isinstance(value, bool) else default
+
+def _intern(value):
+    return sys.intern(value) if isinstance(value, str) else value
+
+class StockItem:
+    """One validated stock item. Names and icons are interned, so every
+    rotation and category listing the same item shares the same strings."""
+
+    __slots__ = ("item_id", "name", "price", "quantity", "icon")
+
+    def __init__(self, item_id, name, price, quantity, icon):
+        self.item_id = item_id
+        self.name = name
+        self.price = price
+        self.quantity = quantity
+        self.icon = icon
+
+    @classmethod
+    def from_api(cls, raw):
+        """Validate one raw API item, None when it is unusable"""
+        if not isinstance(raw, dict):
+            return None
+        name = raw.get("display_name", raw.get("name")) or "Unknown Item"
+        return cls(
+            _intern(str(raw.get("item_id") or name)),
+            _intern(str(name)),
+            _as_number(raw.get("price")),
+            _as_number(raw.get("quantity"), 0),
+            _intern(raw.get("icon")) or None
+        )
+
+    @classmethod
+    def parse_list(cls, raw_items):
+        """Validated items of one category plus its (start_ts, end_ts)"""
+        if not isinstance(raw_items, list):
+            return [], 0, 0
+        raw_items = [raw for raw in raw_items if isinstance(raw, dict)]
+        items = [cls.from_api(raw) for raw in raw_items]
+        start_ts = max((_as_number(raw.get("start_date_unix"), 0) for raw in raw_items), default=0)
+        end_ts = max((_as_number(raw.get("end_date_unix"), 0) for raw in raw_items), default=0)
+        return items, start_ts, end_ts
+
+class StockSnapshot:
+    """One category's items for one rotation, shared by every post showing it"""
+
+    __slots__ = ("id", "slot", "category", "title", "items", "start_ts", "end_ts", "expires_at", "fingerprint", "refs")
+
+    def __init__(self, category, title, items, start_ts, end_ts, fingerprint):
+        self.id = None
+        self.slot = category
+        self.category = category
+        self.title = title
+        self.items = tuple(items)
+        self.start_ts = start_ts
+        self.end_ts = end_ts
+        self.expires_at = end_ts or datetime.now(timezone.utc).timestamp() + WEATHER_FALLBACK_TTL
+        self.fingerprint = fingerprint
+        self.refs = 0
+
+    def content_key(self):
+        return (self.title, self.fingerprint, self.start_ts, self.end_ts)
+
+    def to_state(self):
+        return {
+            "kind": "stock", "category": self.category, "title": self.title,
+            "items": [[i.item_id, i.name, i.price, i.quantity, i.icon] for i in self.items],
+            "start_ts": self.start_ts, "end_ts": self.end_ts, "expires_at": self.expires_at
+        }
+
+    @classmethod
+    def from_state(cls, state):
+        items = [StockItem(*(_intern(value) for value in item)) for item in state["items"]]
+        snapshot = cls(
+            _intern(state["category"]), _intern(state["title"]), items,
+            state["start_ts"], state["end_ts"], SnapshotDiffer.fingerprint(items)
+        )
+        snapshot.expires_at = state["expires_at"]
+        return snapshot
+
+class WeatherSnapshot:
+    """One occurrence of a weather event"""
+
+    __slots__ = ("id", "slot", "weather_id", "name", "description", "start_ts", "end_ts", "expires_at", "refs")
+
+    def __init__(self, weather_id, name, description, start_ts, end_ts):
+        self.id = None
+        self.slot = f"weather:{weather_id}"
+        self.weather_id = weather_id
+        self.name = name
+        self.description = description
+        self.start_ts = start_ts
+        self.end_ts = end_ts
+        self.expires_at = end_ts or datetime.now(timezone.utc).timestamp() + WEATHER_FALLBACK_TTL
+        self.refs = 0
+
+    @classmethod
+    def from_api(cls, raw):
+        """Validate one raw weather entry, None unless it is an active event"""
+        if not isinstance(raw, dict) or not raw.get("weather_id") or not raw.get("active", False):
+            return None
+        return cls(
+            _intern(str(raw["weather_id"])),
+            _intern(str(raw.get("weather_name", "Unknown Weather"))),
+            _intern(str(raw.get("description", "No description available"))),
+            _as_number(raw.get("start_duration_unix"), 0),
+            _as_number(weather_end_ts(raw))
+        )
+
+    def content_key(self):
+        return (self.name, self.description, self.start_ts, self.end_ts)
+
+    def to_state(self):
+        return {
+            "kind": "weather", "weather_id": self.weather_id, "name": self.name,
+            "description": self.description, "start_ts": self.start_ts,
+            "end_ts": self.end_ts, "expires_at": self.expires_at
+        }
+
+    @classmethod
+    def from_state(cls, state):
+        snapshot = cls(
+            _intern(state["weather_id"]), _intern(state["name"]), _intern(state["description"]),
+            state["start_ts"], state["end_ts"]
+        )
+        snapshot.expires_at = state["expires_at"]
+        return snapshot
+
+# State store scopes of the active post checkpoint. Each shard range keeps
+# its own, since snapshot ids are only unique within one process.
+CHECKPOINT_NAME = "main" if RUN_MODE != "shard" else "shards-" + "-".join(map(str, SHARD_IDS or ["all"]))
+SNAPSHOT_SCOPE = f"snapshot:{CHECKPOINT_NAME}"
+POST_SCOPE = f"post:{CHECKPOINT_NAME}"
+
+class SnapshotStore:
+    """Holds every distinct snapshot once.
+
+    Each slot (a stock category or a weather id) has a current snapshot; a
+    poll whose content matches it gets the same object back. Posts pin the
+    snapshot they show with acquire/release, and a snapshot that is neither
+    current nor shown anywhere is dropped. Pinned snapshots are checkpointed
+    in the state store so live posts survive a restart.
+    """
+
+    def __init__(self):
+        self.snapshots = {}  # id -> snapshot
+        self.current = {}    # slot -> snapshot
+        self._next_id = 0
+
+    def publish(self, snapshot):
+        """Return the stored snapshot equal to `snapshot`, storing it if new"""
+        previous = self.current.get(snapshot.slot)
+        if previous is not None and previous.content_key() == snapshot.content_key():
+            return previous
+        self._next_id += 1
+        snapshot.id = self._next_id
+        self.snapshots[snapshot.id] = snapshot
+        self.current[snapshot.slot] = snapshot
+        if previous is not None and previous.refs == 0:
+            del self.snapshots[previous.id]
+        return snapshot
+
+    def stock(self, category, title, raw_items):
+        items, start_ts, end_ts = StockItem.parse_list(raw_items)
+        if not items:
+            return None
+        return self.publish(StockSnapshot(
+            category, title, items, start_ts, end_ts, SnapshotDiffer.fingerprint(items)
+        ))
+
+    def weather(self, raw):
+        snapshot = WeatherSnapshot.from_api(raw)
+        return snapshot and self.publish(snapshot)
+
+    def get(self, snapshot_id):
+        return self.snapshots.get(snapshot_id)
+
+    def acquire(self, snapshot_id):
+        snapshot = self.snapshots[snapshot_id]
+        snapshot.refs += 1
+        if snapshot.refs == 1:
+            state_store.put(SNAPSHOT_SCOPE, str(snapshot_id), snapshot.to_state())
+
+    def release(self, snapshot_id):
+        snapshot = self.snapshots.get(snapshot_id)
+        if snapshot is None:
+            return
+        snapshot.refs -= 1
+        if snapshot.refs <= 0:
+            state_store.delete(SNAPSHOT_SCOPE, str(snapshot_id))
+            if self.current.get(snapshot.slot) is not snapshot:
+                del self.snapshots[snapshot_id]
+
+    def restore(self, snapshot_id, state):
+        """Re-add a checkpointed snapshot under its old id (not as current)"""
+        snapshot = (StockSnapshot if state["kind"] == "stock" else WeatherSnapshot).from_state(state)
+        snapshot.id = snapshot_id
+        self.snapshots[snapshot_id] = snapshot
+        self._next_id = max(self._next_id, snapshot_id)
+        return snapshot
+
+snapshot_store = SnapshotStore()
+
+metrics.gauge(
+    "snapshots",
+    lambda: {(): len(snapshot_store.snapshots)},
+    "Distinct stock/weather snapshots held in memory"
+)
+
+class ActivePost:
+    """A live message: the snapshot it shows, where it is, and (for stock
+    countdowns) what it currently reads and when that next changes"""
+
+    __slots__ = ("guild_id", "snapshot_id", "channel_id", "message_id", "webhook_id", "relative", "rendered", "next_edit_at")
+
+    def __init__(self, guild_id, snapshot_id, channel_id, message_id, relative=False, rendered=None, webhook_id=None):
+        self.guild_id = guild_id
+        self.snapshot_id = snapshot_id
+        self.channel_id = channel_id
+        self.message_id = message_id
+        self.webhook_id = webhook_id  # webhook that sent the message, None if the bot did
+        self.relative = relative
+        self.rendered = rendered
+        self.next_edit_at = None
+
+# Active events tracking: kind -> {key: ActivePost}
 active_events = {
     "stock": {},
     "weather": {},
     "announcements": {}
 }
 
+class TimerHeap:
+    """Min-heap of (when, kind, key) timers.
+
+    Timers are never cancelled in place; callers check a popped timer against
+    the live event and ignore it if the event was replaced or removed.
+    """
+
+    def __init__(self):
+        self.heap = []
+        self._seq = 0
+
+    def schedule(self, when, kind, key):
+        self._seq += 1
+        heapq.heappush(self.heap, (when, self._seq, kind, key))
+
+    def pop_due(self, now, limit=None):
+        due = []
+        while self.heap and self.heap[0][0] <= now and (limit is None or len(due) < limit):
+            when, _, kind, key = heapq.heappop(self.heap)
+            due.append((when, kind, key))
+        return due
+
+    def __len__(self):
+        return len(self.heap)
+
+# Expiry for every active event kind, and the next countdown change of stock posts
+expiry_timers = TimerHeap()
+countdown_timers = TimerHeap()
+
+# When the "Ends In" text of a countdown next changes (a whole minute boundary)
+def next_countdown_change(end_ts, now):
+    remaining = end_ts - now
+    if remaining < 60:
+        return end_ts
+    return end_ts - 60 * int(remaining // 60) + 0.5
+
+def track_event(kind, key, post):
+    """Register an active post and schedule its expiry (and countdown edits)"""
+    now = datetime.now(timezone.utc).timestamp()
+    snapshot_store.acquire(post.snapshot_id)
+    drop_event(kind, key)
+    active_events[kind][key] = post
+    snapshot = snapshot_store.get(post.snapshot_id)
+    expiry_timers.schedule(snapshot.expires_at, kind, key)
+    if kind == "stock" and not post.relative:
+        post.next_edit_at = next_countdown_change(snapshot.expires_at, now)
+        countdown_timers.schedule(post.next_edit_at, kind, key)
+    checkpoint_post(kind, key, post)
+
+def drop_event(kind, key):
+    """Forget an active post and unpin its snapshot"""
+    post = active_events[kind].pop(key, None)
+    if post is not None:
+        snapshot_store.release(post.snapshot_id)
+        state_store.delete(POST_SCOPE, f"{kind}|{key}")
+
+def checkpoint_post(kind, key, post):
+    state_store.put(POST_SCOPE, f"{kind}|{key}", [
+        post.guild_id, post.snapshot_id, post.channel_id, post.message_id, post.relative, post.webhook_id
+    ])
+
+def restore_active_posts():
+    """Reload checkpointed posts of this process's servers, without sending anything.
+
+    A restored countdown is assumed to show the current text; it is edited
+    at its next minute boundary as usual. Returns how many posts came back.
+    """
+    now = datetime.now(timezone.utc).timestamp()
+    for key, state in state_store.load_scope(SNAPSHOT_SCOPE).items():
+        if state["expires_at"] > now:
+            snapshot_store.restore(int(key), state)
+        else:
+            state_store.delete(SNAPSHOT_SCOPE, key)
+    restored = 0
+    for row_key, row in state_store.load_scope(POST_SCOPE).items():
+        # Checkpoints written before webhook delivery have no webhook id
+        guild_id, snapshot_id, channel_id, message_id, relative, webhook_id = (row + [None])[:6]
+        kind, key = row_key.split("|", 1)
+        snapshot = snapshot_store.get(snapshot_id)
+        if snapshot is None or snapshot.expires_at <= now:
+            state_store.delete(POST_SCOPE, row_key)
+            continue
+        if bot.get_guild(guild_id) is None or key in active_events[kind]:
+            continue
+        rendered = None if relative else countdown_text(snapshot.expires_at, now)
+        track_event(kind, key, ActivePost(guild_id, snapshot_id, channel_id, message_id, relative, rendered, webhook_id))
+        restored += 1
+    for snapshot in sorted(snapshot_store.snapshots.values(), key=lambda s: s.start_ts):
+        if snapshot.refs == 0:
+            # Restored, but nobody here is showing it any more
+            del snapshot_store.snapshots[snapshot.id]
+            state_store.delete(SNAPSHOT_SCOPE, str(snapshot.id))
+        elif isinstance(snapshot, StockSnapshot):
+            # Changes made upstream while we were down become in-place edits
+            stock_differ.remember(snapshot)
+    return restored
+
+metrics.gauge(
+    "active_events",
+    lambda: {(("kind", kind),): len(events) for kind, events in active_events.items()},
+    "Live posts tracked per kind"
+)
+metrics.gauge(
+    "timers",
+    lambda: {(("heap", "expiry"),): len(expiry_timers), (("heap", "countdown"),): len(countdown_timers)},
+    "Pending timers per heap"
+)
+
+def expire_events(now):
+    """Drop every active event whose end time has passed, O(log n) each"""
+    expired = 0
+    for when, kind, key in expiry_timers.pop_due(now):
+        post = active_events[kind].get(key)
+        if post is None:
+            continue
+        # A newer post may have replaced this key since the timer was set
+        snapshot = snapshot_store.get(post.snapshot_id)
+        if snapshot is None or snapshot.expires_at <= now:
+            drop_event(kind, key)
+            expired += 1
+    return expired
+
 # Stock category mapping
 STOCK_CATEGORY_MAPPING = {
     "seed": ("seed_stock", "Seeds 🌱"),
@@ -206,23 +2000,30 @@ def get_channel_for_category(category_key):
     return None
 
 # Create invite button view
+# The view only holds a link button, so one instance is shared by every message
+_invite_view = None
+
 def create_invite_view():
-    view = View(timeout=None)
-    button = Button(label="Invite Bot", url=INVITE_URL, style=discord.ButtonStyle.link)
-    view.add_item(button)
-    return view
+    global _invite_view
+    if _invite_view is None:
+        view = View(timeout=None)
+        button = Button(label="Invite Bot", url=INVITE_URL, style=discord.ButtonStyle.link)
+        view.add_item(button)
+        _invite_view = view
+    return _invite_view
 
 # Create stock embed
-def create_stock_embed(items, title, start_ts, end_ts):
-    embed = discord.Embed(title=title, color=discord.Color.green())
+def create_stock_embed(snapshot, relative=False):
+    embed = discord.Embed(title=snapshot.title, color=discord.Color.green())
+    items = snapshot.items
     
     # Add items
     if items:
         item_text = ""
         for item in items[:10]:  # Limit to 10 items
-            name = item.get("display_name", item.get("name", "Unknown Item"))
-            price = item.get("price")
-            quantity = item.get("quantity", 0)
+            name = item.name
+            price = item.price
+            quantity = item.quantity
             
             if price is not None:
                 if quantity > 0:
@@ -237,55 +2038,61 @@ def create_stock_embed(items, title, start_ts, end_ts):
         embed.add_field(name="📦 Items", value=item_text or "No items", inline=False)
         
         # Add thumbnail from first item's icon if available
-        if items and items[0].get("icon"):
-            embed.set_thumbnail(url=items[0]["icon"])
+        if items[0].icon:
+            embed.set_thumbnail(url=items[0].icon)
     
     # Add timing
-    embed.add_field(name="🕒 Started", value=f"{time_ago(start_ts)}", inline=True)
-    
-    if end_ts:
-        now = datetime.now(timezone.utc).timestamp()
-        if end_ts > now:
-            remaining = end_ts - now
-            hours = int(remaining // 3600)
-            mins = int((remaining % 3600) // 60)
-            embed.add_field(name="⏱️ Ends In", value=f"{hours}h {mins}m", inline=True)
-        else:
-            embed.add_field(name="⏱️ Status", value="Expired", inline=True)
+    add_timing_fields(embed, snapshot.start_ts, snapshot.end_ts, relative)
     
     return embed
 
+# End timestamp of a weather event, derived from its duration when missing
+def weather_end_ts(weather_data):
+    start_ts = weather_data.get("start_duration_unix", 0)
+    end_ts = weather_data.get("end_duration_unix")
+    if end_ts is None and start_ts and weather_data.get("duration"):
+        end_ts = start_ts + weather_data["duration"]
+    return end_ts
+
 # Create weather embed
-def create_weather_embed(weather_data):
-    name = weather_data.get("weather_name", "Unknown Weather")
-    description = weather_data.get("description", "No description available")
-    
+def create_weather_embed(snapshot, relative=False):
     embed = discord.Embed(
-        title=f"🌤️ {name}",
-        description=description,
+        title=f"🌤️ {snapshot.name}",
+        description=snapshot.description,
         color=discord.Color.blue()
     )
     
-    start_ts = weather_data.get("start_duration_unix", 0)
-    duration = weather_data.get("duration", 0)
-    end_ts = weather_data.get("end_duration_unix")
-    
-    if end_ts is None and start_ts and duration:
-        end_ts = start_ts + duration
+    add_timing_fields(embed, snapshot.start_ts, snapshot.end_ts, relative)
     
-    embed.add_field(name="🕒 Started", value=f"{time_ago(start_ts)}", inline=True)
+    return embed
+
+# Countdown text shown in the "Ends In" field, None once expired
+def countdown_text(end_ts, now=None):
+    if now is None:
+        now = datetime.now(timezone.utc).timestamp()
+    if end_ts <= now:
+        return None
+    remaining = end_ts - now
+    hours = int(remaining // 3600)
+    mins = int((remaining % 3600) // 60)
+    return f"{hours}h {mins}m"
+
+# Started / Ends In fields shared by stock and weather embeds.
+# relative=True uses Discord timestamps, which clients count down themselves.
+def add_timing_fields(embed, start_ts, end_ts, relative=False):
+    if relative:
+        embed.add_field(name="🕒 Started", value=f"<t:{int(start_ts)}:R>", inline=True)
+    else:
+        embed.add_field(name="🕒 Started", value=f"{time_ago(start_ts)}", inline=True)
     
     if end_ts:
-        now = datetime.now(timezone.utc).timestamp()
-        if end_ts > now:
-            remaining = end_ts - now
-            hours = int(remaining // 3600)
-            mins = int((remaining % 3600) // 60)
-            embed.add_field(name="⏱️ Ends In", value=f"{hours}h {mins}m", inline=True)
-        else:
+        remaining = countdown_text(end_ts)
+        if remaining is None:
             embed.add_field(name="⏱️ Status", value="Expired", inline=True)
-    
-    return embed
+        elif relative:
+            embed.add_field(name="⏱️ Ends", value=f"<t:{int(end_ts)}:R>", inline=True)
+        else:
+            embed.add_field(name="⏱️ Ends In", value=remaining, inline=True)
 
 # Time Ago Helper (UTC based)
 def time_ago(ts: float) -> str:
@@ -302,138 +2109,981 @@ def time_ago(ts: float) -> str:
     d = diff // 86400
     return f"{d} day{'s' if d != 1 else ''} ago"
 
+# --- Render Cache ---
+class RenderCache:
+    """Builds each stock/weather embed once per rotation and countdown minute.
+
+    Entries are keyed by (category, start_ts, expires_at, relative) and
+    remember the "Ends In" text they were rendered with; the embed is only
+    rebuilt when that text changes. Relative-timestamp embeds never change.
+    Snapshots that have expired are evicted, including weather without an
+    end timestamp, which expires WEATHER_FALLBACK_TTL after it was seen.
+    """
+
+    def __init__(self):
+        self.entries = {}  # (category, start_ts, expires_at, relative) -> (countdown, embed)
+        self.stats = {"hits": 0, "misses": 0, "evicted": 0}
+
+    def _get(self, key, end_ts, build):
+        now = datetime.now(timezone.utc).timestamp()
+        relative = key[3]
+        bucket = None if relative or not end_ts else countdown_text(end_ts, now)
+        entry = self.entries.get(key)
+        if entry and entry[0] == bucket:
+            self.stats["hits"] += 1
+            return entry[1]
+        self.stats["misses"] += 1
+        if entry is None:
+            self.evict_expired(now)
+        embed = build()
+        self.entries[key] = (bucket, embed)
+        return embed
+
+    def stock_embed(self, snapshot, relative=False):
+        return self._get(
+            (snapshot.category, snapshot.start_ts, snapshot.expires_at, relative), snapshot.end_ts,
+            lambda: create_stock_embed(snapshot, relative)
+        )
+
+    def weather_embed(self, snapshot, relative=False):
+        return self._get(
+            (snapshot.slot, snapshot.start_ts, snapshot.expires_at, relative), snapshot.end_ts,
+            lambda: create_weather_embed(snapshot, relative)
+        )
+
+    def invalidate(self, category):
+        for key in [key for key in self.entries if key[0] == category]:
+            del self.entries[key]
+
+    def evict_expired(self, now=None):
+        if now is None:
+            now = datetime.now(timezone.utc).timestamp()
+        expired = [key for key in self.entries if key[2] <= now]
+        for key in expired:
+            del self.entries[key]
+        self.stats["evicted"] += len(expired)
+
+render_cache = RenderCache()
+
+# --- Poll Scheduling ---
+class PollPlanner:
+    """Plans the next upstream poll of one feed.
+
+    Sleeps until just after the next expected rotation (the earliest end
+    timestamp in the last response), polls every `min_interval` seconds once
+    that rotation is due until the payload actually changes, and backs off
+    exponentially while the feed is quiet or the upstream API is failing.
+    """
+
+    def __init__(self, name, base, min_interval, max_interval, grace=2, chase_window=180):
+        self.name = name
+        self.base = base
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.grace = grace
+        self.chase_window = chase_window
+        self.fingerprint = None
+        self.expected = None  # when we expect the payload to change next
+        self.failures = 0
+        self.quiet = 0
+        self.delay = base
+        self.next_poll_at = None  # wall-clock time the next poll is planned for
+
+    def _clamp(self, delay):
+        return max(self.min_interval, min(self.max_interval, delay))
+
+    def record_error(self):
+        self.failures += 1
+        self.delay = self._clamp(self.min_interval * 2 ** self.failures)
+        self.next_poll_at = time.time() + self.delay
+        return self.delay
+
+    def record(self, fingerprint, next_rotation, now=None):
+        """Record a successful poll and return the delay until the next one"""
+        if now is None:
+            now = datetime.now(timezone.utc).timestamp()
+        self.failures = 0
+        changed = fingerprint != self.fingerprint
+        self.fingerprint = fingerprint
+        if changed:
+            self.quiet = 0
+
+        if next_rotation and next_rotation > now:
+            self.expected = next_rotation
+            self.delay = self._clamp(next_rotation - now + self.grace)
+        elif not changed and self.expected and now - self.expected < self.chase_window:
+            # Rotation is due but not visible upstream yet
+            self.delay = self.min_interval
+        else:
+            self.quiet += 1
+            self.delay = self._clamp(self.base * 2 ** (self.quiet - 1))
+        self.next_poll_at = now + self.delay
+        return self.delay
+
+# (fingerprint, next expected change) of a stock / weather payload for a PollPlanner
+def stock_poll_hint(raw, now):
+    stock = raw[0] if isinstance(raw, list) else raw
+    fingerprint, upcoming = [], []
+    for state_key, (api_key, _) in STOCK_CATEGORY_MAPPING.items():
+        items, _, end_ts = StockItem.parse_list(stock.get(api_key, []))
+        if not items:
+            continue
+        fingerprint.append((state_key, SnapshotDiffer.fingerprint(items)))
+        if end_ts > now:
+            upcoming.append(end_ts)
+    return tuple(fingerprint), min(upcoming, default=None)
+
+def weather_poll_hint(data, now):
+    active = [w for w in map(WeatherSnapshot.from_api, data.get("weather", [])) if w]
+    ends = [w.end_ts for w in active if w.end_ts and w.end_ts > now]
+    fingerprint = frozenset((w.weather_id, w.start_ts) for w in active)
+    return fingerprint, min(ends, default=None)
+
+stock_planner = PollPlanner("stock", base=300, min_interval=5, max_interval=600)
+weather_planner = PollPlanner("weather", base=20, min_interval=5, max_interval=120)
+
+# --- Snapshot Diff ---
+class StockDiff:
+    """What changed in one stock category since the previous snapshot"""
+
+    def __init__(self, category, fingerprint, start_ts, end_ts, new_rotation, added, removed, changed):
+        self.category = category
+        self.fingerprint = fingerprint
+        self.start_ts = start_ts
+        self.end_ts = end_ts
+        self.new_rotation = new_rotation
+        self.added = added      # item_id -> StockItem
+        self.removed = removed  # item_id -> (quantity, price)
+        self.changed = changed  # item_id -> ((old quantity, old price), StockItem)
+
+    def summary(self):
+        return f"+{len(self.added)} -{len(self.removed)} ~{len(self.changed)}"
+
+class SnapshotDiffer:
+    """Fingerprints each category snapshot and diffs it against the last one.
+
+    The fingerprint is a stable hash of (item_id, quantity, price), so an
+    unchanged snapshot is detected with a single comparison and yields None.
+    """
+
+    def __init__(self):
+        self.snapshots = {}  # category -> (fingerprint, start_ts, {item_id: (quantity, price)})
+
+    @staticmethod
+    def fingerprint(items):
+        digest = hashlib.blake2b(digest_size=16)
+        for key, quantity, price in sorted((i.item_id, i.quantity, i.price) for i in items):
+            digest.update(f"{key}|{quantity}|{price}\n".encode())
+        return digest.hexdigest()
+
+    def remember(self, snapshot):
+        """Make `snapshot` the one the next diff of its category compares against"""
+        self.snapshots[snapshot.category] = (
+            snapshot.fingerprint, snapshot.start_ts,
+            {i.item_id: (i.quantity, i.price) for i in snapshot.items}
+        )
+
+    def diff(self, snapshot):
+        """Return a StockDiff against the category's last StockSnapshot, or None when unchanged"""
+        category, fingerprint, start_ts = snapshot.category, snapshot.fingerprint, snapshot.start_ts
+        previous = self.snapshots.get(category)
+        if previous and previous[0] == fingerprint and previous[1] == start_ts:
+            return None
+
+        current = {i.item_id: i for i in snapshot.items}
+        before = previous[2] if previous else {}
+        added = {key: item for key, item in current.items() if key not in before}
+        removed = {key: state for key, state in before.items() if key not in current}
+        changed = {}
+        for key, item in current.items():
+            if key in before and before[key] != (item.quantity, item.price):
+                changed[key] = (before[key], item)
+
+        self.remember(snapshot)
+        new_rotation = previous is None or start_ts != previous[1]
+        return StockDiff(category, fingerprint, start_ts, snapshot.end_ts, new_rotation, added, removed, changed)
+
+stock_differ = SnapshotDiffer()
+
+# --- Freshness Tracing ---
+TRACE_STAGES = ["scheduled", "fetched", "parsed", "diffed", "rendered", "queued"]
+
+class RotationTrace:
+    """Stage timestamps of one rotation, from poll to every per-guild send"""
+
+    def __init__(self, category, start_ts):
+        self.category = category
+        self.start_ts = start_ts
+        self.stages = {}
+        self.lags = []  # per-guild seconds from rotation start to message sent
+
+    def mark(self, stage, at=None):
+        # Keep the first time a stage was reached for this rotation
+        self.stages.setdefault(stage, time.time() if at is None else at)
+
+    def report(self):
+        parts = [f"{stage} +{self.stages[stage] - self.start_ts:.1f}s" for stage in TRACE_STAGES if stage in self.stages]
+        if self.lags:
+            parts.append(f"sent p50 +{percentile(self.lags, 50):.1f}s p99 +{percentile(self.lags, 99):.1f}s ({len(self.lags)})")
+        return " → ".join(parts)
+
+class FreshnessTracer:
+    """Keeps traces of recent rotations and each server's latest delivery lag"""
+
+    def __init__(self, keep=10):
+        self.keep = keep
+        self.traces = {}      # (category, start_ts) -> RotationTrace
+        self.order = deque()  # insertion order, for eviction
+        self.guild_lags = {}  # (guild_id, category) -> (start_ts, lag)
+
+    def trace(self, category, start_ts):
+        key = (category, start_ts)
+        trace = self.traces.get(key)
+        if trace is None:
+            trace = self.traces[key] = RotationTrace(category, start_ts)
+            self.order.append(key)
+            # Bound memory to `keep` rotations per category on average
+            while len(self.order) > self.keep * (len(STOCK_CATEGORY_MAPPING) + 1):
+                self.traces.pop(self.order.popleft(), None)
+        return trace
+
+    def sent(self, category, start_ts, guild_id):
+        lag = time.time() - start_ts
+        self.trace(category, start_ts).lags.append(lag)
+        self.guild_lags[(guild_id, category)] = (start_ts, lag)
+        metrics.observe("freshness_lag_seconds", lag, category=category)
+
+    def recent(self, category):
+        return [t for (c, _), t in self.traces.items() if c == category]
+
+tracer = FreshnessTracer()
+
+# --- Restock Watchlists ---
+WATCH_LIMIT_PER_USER = 25
+# Watch DMs get their own small engine; with delivery's 45/s the bot stays under Discord's 50/s
+WATCH_DM_RATE = 5
+WATCH_MENTIONS_PER_LINE = 60
+
+def normalize_item_id(text):
+    return "_".join(text.lower().split())
+
+class WatchIndex:
+    """Restock watches per (user, server), indexed both ways.
+
+    by_item maps item_id -> (user_id, guild_id) keys, so matching a rotation
+    costs O(items in it + matches) however many watches exist. entries holds
+    the items of each key and how to notify the user: by DM, or by a
+    mention in that server's stock channel. Keying by server means only the
+    shard that owns a server ever writes its rows.
+    """
+
+    def __init__(self):
+        self.by_item = {}  # item_id -> {(user_id, guild_id)}
+        self.entries = {}  # (user_id, guild_id) -> {"items": {item_id}, "mode": "dm"|"mention", "dm_channel_id": ...}
+
+    def load(self):
+        for row_key, entry in state_store.load_scope("watch").items():
+            if "|" in row_key:
+                user_id, guild_id = map(int, row_key.split("|"))
+            else:
+                # Rows from before per-server watches: one per user, moved to the server it names
+                user_id, guild_id = int(row_key), entry.get("guild_id")
+                state_store.delete("watch", row_key)
+                if guild_id is None:
+                    continue
+            key = (user_id, guild_id)
+            items = {sys.intern(item_id) for item_id in entry.get("items", [])}
+            self.entries[key] = {"items": items, "mode": entry.get("mode", "dm"), "dm_channel_id": entry.get("dm_channel_id")}
+            for item_id in items:
+                self.by_item.setdefault(item_id, set()).add(key)
+            if "|" not in row_key:
+                self._save(key)
+
+    def get(self, user_id, guild_id):
+        return self.entries.get((user_id, guild_id))
+
+    def _save(self, key):
+        entry = self.entries.get(key)
+        row_key = f"{key[0]}|{key[1]}"
+        if entry is None or not entry["items"]:
+            self.entries.pop(key, None)
+            state_store.delete("watch", row_key)
+        else:
+            state_store.put("watch", row_key, {**entry, "items": sorted(entry["items"])})
+
+    def watch(self, user_id, item_id, mode, guild_id, dm_channel_id=None):
+        """Add a watch. Returns False when the user already has WATCH_LIMIT_PER_USER in this server"""
+        key = (user_id, guild_id)
+        entry = self.entries.setdefault(key, {"items": set(), "mode": "dm", "dm_channel_id": None})
+        if item_id not in entry["items"] and len(entry["items"]) >= WATCH_LIMIT_PER_USER:
+            return False
+        entry["mode"] = mode
+        entry["dm_channel_id"] = dm_channel_id or entry["dm_channel_id"]
+        item_id = sys.intern(item_id)
+        entry["items"].add(item_id)
+        self.by_item.setdefault(item_id, set()).add(key)
+        self._save(key)
+        return True
+
+    def unwatch(self, user_id, guild_id, item_id=None):
+        """Remove one watch, or all of the user's in this server when item_id is None.
+        Returns how many were removed"""
+        key = (user_id, guild_id)
+        entry = self.entries.get(key)
+        if entry is None:
+            return 0
+        if item_id is None:
+            removed = list(entry["items"])
+        else:
+            removed = [item_id] if item_id in entry["items"] else []
+        for item in removed:
+            entry["items"].discard(item)
+            keys = self.by_item.get(item)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.by_item[item]
+        self._save(key)
+        return len(removed)
+
+    def match(self, items):
+        """(user_id, guild_id) -> [StockItem] for every watched item among `items`"""
+        matches = {}
+        for item in items:
+            for key in self.by_item.get(item.item_id, ()):
+                matches.setdefault(key, []).append(item)
+        return matches
+
+watch_index = WatchIndex()
+watch_index.load()
+dm_delivery = DeliveryEngine(max_concurrency=5, global_rate=WATCH_DM_RATE)
+# Notification rounds still delivering; DMs are slow on purpose, so polls don't wait for them
+watch_tasks = set()
+
+metrics.gauge(
+    "watch_entries",
+    lambda: {(): sum(len(users) for users in watch_index.by_item.values())},
+    "Restock watches across all users"
+)
+
+# Join lines into as few messages of at most `limit` characters as possible
+def pack_messages(lines, limit=2000):
+    messages, current = [], ""
+    for line in lines:
+        if current and len(current) + 1 + len(line) > limit:
+            messages.append(current)
+            current = line
+        else:
+            current = f"{current}\n{line}" if current else line
+    if current:
+        messages.append(current)
+    return messages
+
+async def notify_watchers(found):
+    """Notify everyone watching an item in `found`, a list of (snapshot, items).
+
+    Each DM user gets one message listing all their items; mention-mode users
+    are grouped into as few messages as possible per stock channel, and fall
+    back to a DM when that server has no channel for the item's category.
+    """
+    matches = {}
+    for snapshot, items in found:
+        for key, hits in watch_index.match(items).items():
+            matches.setdefault(key, []).extend((snapshot, item) for item in hits)
+    if not matches:
+        return
+
+    dms = {}       # user_id -> (dm_channel_id, {item name: item}), one DM per user
+    mentions = {}  # channel_id -> (guild, {item name: [user_id]})
+    for (user_id, guild_id), hits in matches.items():
+        guild = bot.get_guild(guild_id)
+        if guild is None:
+            continue  # Another shard owns this server, or the bot left it
+        entry = watch_index.get(user_id, guild_id)
+        for snapshot, item in hits:
+            channel_id = get_channel_for_server(guild.id, snapshot.category) if entry["mode"] == "mention" else None
+            if channel_id:
+                mentions.setdefault(channel_id, (guild, {}))[1].setdefault(item.name, []).append(user_id)
+            elif entry.get("dm_channel_id"):
+                dms.setdefault(user_id, (entry["dm_channel_id"], {}))[1].setdefault(item.name, item)
+
+    dm_jobs = []
+    for dm_channel_id, dm_items in dms.values():
+        lines = [f"• {item.name}" + (f" (Qty: {item.quantity})" if item.quantity > 0 else "") for item in dm_items.values()]
+        dm_jobs.append(DeliveryJob(
+            None, dm_channel_id,
+            {"content": pack_messages(["🔔 Now in stock:", *lines])[0]},
+            partial=True
+        ))
+
+    allowed = discord.AllowedMentions(everyone=False, roles=False, users=True)
+    mention_jobs = []
+    for channel_id, (guild, by_item) in mentions.items():
+        lines = []
+        for name, user_ids in by_item.items():
+            for i in range(0, len(user_ids), WATCH_MENTIONS_PER_LINE):
+                chunk = user_ids[i:i + WATCH_MENTIONS_PER_LINE]
+                lines.append(f"🔔 **{name}** is in stock: " + " ".join(f"<@{u}>" for u in chunk))
+        for content in pack_messages(lines):
+            mention_jobs.append(DeliveryJob(guild, channel_id, {"content": content, "allowed_mentions": allowed}))
+
+    metrics.inc("watch_notifications_total", len(dm_jobs), mode="dm")
+    metrics.inc("watch_notifications_total", len(mention_jobs), mode="mention")
+    await asyncio.gather(
+        dm_delivery.fan_out("watch DMs", dm_jobs),
+        delivery.fan_out("watch mentions", mention_jobs)
+    )
+
+def start_watch_notifications(found):
+    """Run notify_watchers in the background, keeping a reference until it is done"""
+    if not found:
+        return
+    task = asyncio.create_task(notify_watchers(found))
+    watch_tasks.add(task)
+    task.add_done_callback(watch_tasks.discard)
+
 # Weather and stock checking functions
-async def check_new_weather(is_restart: bool = False):
-    """Check for weather events, with option to handle restart cases"""
-    logging.info("🌡️ Checking for weather events...")
-    async with aiohttp.ClientSession() as session:
+# --- Stock Archive ---
+# Segment block: header (magic, item code count, record count, compressed size),
+# the sorted item codes the block holds, then the zlib-compressed records
+ARCHIVE_BLOCK = struct.Struct("<4sHII")
+ARCHIVE_MAGIC = b"GAG2"
+# Record: item code, start, end, price (NaN if unknown), quantity
+ARCHIVE_RECORD = struct.Struct("<IIIdI")
+ARCHIVE_SCOPE = "archive"
+ARCHIVE_INDEX_DAYS = 400       # newest segment days remembered per item
+ARCHIVE_INDEX_REFRESH = 30     # seconds between index reloads in read-only shards
+# Shards share the archive directory; only one process appends to it
+ARCHIVE_WRITER = RUN_MODE != "shard" or not SHARD_IDS or 0 in SHARD_IDS
+
+class StockArchive:
+    """Append-only history of every item appearance (stock items and weather).
+
+    Records are partitioned into one segment file per UTC day and appended
+    as compressed blocks whose headers list the items inside, so a reader
+    memory-maps a segment and only decompresses the blocks of the item it
+    wants. The index lives in the state store, one row per (category, item):
+    the item's code, the most recent days it appeared on and a running
+    summary (count, first/last seen) that answers "last seen" and "average
+    interval" without reading any segment. Only rows that changed are
+    written, and they are committed before the records that use them.
+    """
+
+    def __init__(self, path, store):
+        self.path = path
+        self.store = store    # StateStore holding the index
+        self.entries = {}     # "category|item_id" -> index entry
+        self.by_item = {}     # item_id -> {"category|item_id", ...}
+        self.loaded_at = None
+        self.pending = []     # (day, packed record, item code)
+        self.dirty = set()    # index keys changed since the last flush
+        self.stats = {"records": 0, "blocks": 0, "queries": 0, "blocks_read": 0}
+
+    def load(self):
+        """Load the index; read-only shards reload it now and then to see new items"""
+        if self.loaded_at is not None and (ARCHIVE_WRITER or time.monotonic() - self.loaded_at < ARCHIVE_INDEX_REFRESH):
+            return
+        self.entries = self.store.load_scope(ARCHIVE_SCOPE)
+        self.by_item = {}
+        for key in self.entries:
+            self.by_item.setdefault(key.split("|", 1)[1], set()).add(key)
+        self.loaded_at = time.monotonic()
+
+    def record(self, category, start_ts, end_ts, items):
+        """Queue the appearances of (item_id, name, price, quantity) in one rotation.
+
+        An item is only recorded once per category and start time, so
+        re-polls, restarts and within-rotation changes do not duplicate it.
+        """
+        if not ARCHIVE_WRITER or not start_ts:
+            return
+        day = time.strftime("%Y-%m-%d", time.gmtime(start_ts))
+        for item_id, name, price, quantity in items:
+            key = f"{category}|{item_id}"
+            entry = self.entries.get(key)
+            if entry is None:
+                entry = self.entries[key] = {
+                    "code": len(self.entries), "name": name, "days": [], "count": 0, "first": start_ts, "last": 0
+                }
+                self.by_item.setdefault(item_id, set()).add(key)
+            elif start_ts <= entry["last"]:
+                continue
+            if not entry["days"] or entry["days"][-1] != day:
+                entry["days"].append(day)
+                del entry["days"][:-ARCHIVE_INDEX_DAYS]
+            entry.update(name=name, count=entry["count"] + 1, last=start_ts)
+            self.dirty.add(key)
+            price = float("nan") if price is None else float(price)
+            self.pending.append((day, ARCHIVE_RECORD.pack(
+                entry["code"], int(start_ts), int(end_ts or start_ts), price, int(quantity or 0)
+            ), entry["code"]))
+
+    def _write(self, batch):
+        os.makedirs(self.path, exist_ok=True)
+        by_day = {}
+        for day, packed, code in batch:
+            by_day.setdefault(day, []).append((packed, code))
+        for day, rows in by_day.items():
+            codes = sorted({code for _, code in rows})
+            payload = zlib.compress(b"".join(packed for packed, _ in rows), 6)
+            with open(os.path.join(self.path, f"{day}.seg"), "ab") as f:
+                f.write(ARCHIVE_BLOCK.pack(ARCHIVE_MAGIC, len(codes), len(rows), len(payload)))
+                f.write(struct.pack(f"<{len(codes)}I", *codes))
+                f.write(payload)
+        return len(by_day)
+
+    async def flush(self):
+        """Commit the changed index rows, then append queued records off the event loop.
+
+        A record's item code is always committed before the record is on
+        disk, so a crash can lose an appearance but never leave a code
+        that a new item would be given again after a restart.
+        """
+        if not self.pending:
+            return
+        for key in self.dirty:
+            self.store.put(ARCHIVE_SCOPE, key, self.entries[key])
+        dirty, self.dirty = self.dirty, set()
+        await self.store.flush()
+        if any((ARCHIVE_SCOPE, key) in self.store.pending for key in dirty):
+            self.dirty |= dirty  # The state store write failed; try again next flush
+            return
+        batch, self.pending = self.pending, []
         try:
-            async with session.get(WEATHER_API_URL) as r:
-                if r.status == 200 and r.content_type == 'application/json':
-                    data = await r.json()
-                    wlist = data.get("weather", [])
-                    logging.info(f"🌤️ Received {len(wlist)} weather events from API")
-                else:
-                    text = await r.text()
-                    logging.warning(f"⚠️ Weather API returned non-JSON: {text[:200]}")
-                    return
+            self.stats["blocks"] += await asyncio.to_thread(self._write, batch)
         except Exception as e:
-            logging.error(f"⚠️ Weather API Error: {e}")
+            self.pending = batch + self.pending
+            logging.error(f"⚠️ Archive write failed: {e}")
             return
+        self.stats["records"] += len(batch)
+
+    def _read_segment(self, day, code):
+        """Records of one item in one segment, reading only the blocks that hold it"""
+        path = os.path.join(self.path, f"{day}.seg")
+        try:
+            f = open(path, "rb")
+        except OSError:
+            return []
+        rows = []
+        with f:
+            size = os.fstat(f.fileno()).st_size
+            if size == 0:
+                return rows
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                offset = 0
+                while offset + ARCHIVE_BLOCK.size <= size:
+                    magic, n_codes, n_records, length = ARCHIVE_BLOCK.unpack_from(mm, offset)
+                    codes_at = offset + ARCHIVE_BLOCK.size
+                    payload_at = codes_at + 4 * n_codes
+                    if magic != ARCHIVE_MAGIC or payload_at + length > size:
+                        break  # Torn or partly written tail
+                    codes = struct.unpack_from(f"<{n_codes}I", mm, codes_at)
+                    i = bisect.bisect_left(codes, code)
+                    if i < n_codes and codes[i] == code:
+                        self.stats["blocks_read"] += 1
+                        payload = zlib.decompress(mm[payload_at:payload_at + length])
+                        rows.extend(r for r in ARCHIVE_RECORD.iter_unpack(payload) if r[0] == code)
+                    offset = payload_at + length
+        return rows
+
+    def recent(self, code, days, limit):
+        """The newest `limit` appearances of an item, newest first, from its segments"""
+        rows = []
+        for day in reversed(days):
+            rows.extend(self._read_segment(day, code))
+            if len(rows) >= limit:
+                break
+        rows.sort(key=lambda r: r[1], reverse=True)
+        return rows[:limit]
+
+    def lookup(self, item_id, category=None):
+        """(category, index entry) of an item, the most recently seen category
+        unless one is given; None if it was never seen"""
+        self.load()
+        keys = [f"{category}|{item_id}"] if category else self.by_item.get(item_id, ())
+        found = [(key, self.entries[key]) for key in keys if key in self.entries]
+        if not found:
+            return None
+        key, entry = max(found, key=lambda pair: pair[1]["last"])
+        return key.split("|", 1)[0], entry
+
+    async def history(self, item_id, category=None, limit=10):
+        """(category, summary, recent appearances as dicts) of an item, None if it was never seen"""
+        found = self.lookup(item_id, category)
+        if found is None:
+            return None
+        category, entry = found
+        self.stats["queries"] += 1
+        rows = await asyncio.to_thread(self.recent, entry["code"], list(entry["days"]), limit)
+        return category, entry, [
+            {"start": start, "end": end, "price": None if price != price else price, "quantity": quantity}
+            for _, start, end, price, quantity in rows
+        ]
+
+stock_archive = StockArchive(ARCHIVE_DIR, state_store)
+stock_archive.load()
+metrics.gauge(
+    "archive",
+    lambda: {
+        (("stat", "items"),): len(stock_archive.entries),
+        (("stat", "pending"),): len(stock_archive.pending),
+        **{(("stat", k),): v for k, v in stock_archive.stats.items()}
+    },
+    "Item appearances archived, blocks written and history queries served"
+)
+
+async def check_new_weather(is_restart: bool = False, snapshot=None):
+    """Check for weather events, with option to handle restart cases.
+
+    snapshot is a (status, data) pair already fetched by the poller process.
+    """
+    logging.info("🌡️ Checking for weather events...")
+    scheduled_at = min(weather_planner.next_poll_at or time.time(), time.time())
+    try:
+        status, data = snapshot or await snapshot_cache.refresh(WEATHER_API_URL)
+    except Exception as e:
+        logging.error(f"⚠️ Weather API Error: {e}")
+        weather_planner.record_error()
+        return
+    if data is None:
+        weather_planner.record_error()
+        return
+    fetched_at = time.time()
+    wlist = data.get("weather", [])
+    if status == 200:
+        logging.info(f"🌤️ Received {len(wlist)} weather events from API")
+
+    def on_weather_sent(guild, channel_id, w, weather_key):
+        def record(msg):
+            logging.info(f"✅ Sent {'RESTART ' if is_restart else ''}weather event: {w.name} to {guild.name}")
+            track_event("weather", weather_key, ActivePost(
+                guild.id, w.id, channel_id, msg.id, webhook_id=getattr(msg, "webhook_id", None)
+            ))
+            weather_claims.commit(weather_key, w.start_ts)
+            tracer.sent("weather", w.start_ts, guild.id)
+        return record
+
+    # Only active, well-formed events can be posted
+    active_weather = [w for w in map(snapshot_store.weather, wlist) if w]
+    now = datetime.now(timezone.utc).timestamp()
+    weather_planner.record(*weather_poll_hint(data, now), now)
+    for w in active_weather:
+        stock_archive.record("weather", w.start_ts, w.end_ts, [(w.weather_id, w.name, None, 0)])
+        trace = tracer.trace("weather", w.start_ts)
+        trace.mark("scheduled", scheduled_at)
+        trace.mark("fetched", fetched_at)
+        trace.mark("parsed")
+        trace.mark("diffed")
+
+    def on_board_sent(guild, channel_id, claimed):
+        def record(msg):
+            for w, weather_key in claimed:
+                on_weather_sent(guild, channel_id, w, weather_key)(msg)
+        return record
 
-    new_events_count = 0
-    for guild in bot.guilds:
-        weather_channel_id = get_channel_for_server(guild.id, "weather")
-        if not weather_channel_id:
+    def release_all(claimed):
+        def release():
+            for w, weather_key in claimed:
+                weather_claims.release(weather_key, w.start_ts)
+        return release
+
+    # Claiming is synchronous and cheap; the sends run afterwards, concurrently
+    jobs = []
+    queued_starts = set()
+    board_hashes = {}  # relative -> hash of the board showing every active event
+    for guild, weather_channel_id in iter_subscribers("weather"):
+        relative = uses_relative_countdown(guild.id)
+        claimed = []
+        for w in active_weather:
+            weather_key = f"{guild.id}_{w.weather_id}"
+            if weather_claims.claim(weather_key, w.start_ts):
+                claimed.append((w, weather_key))
+                queued_starts.add(w.start_ts)
+        if not claimed:
             continue
-            
-        for w in wlist:
-            if not isinstance(w, dict):
+        if uses_live_board(guild.id):
+            # One board lists every active event (a message holds up to 10 embeds)
+            kwargs = {"embeds": [render_cache.weather_embed(w, relative) for w in active_weather[:10]], "view": create_invite_view()}
+            if relative not in board_hashes:
+                board_hashes[relative] = embed_hash(kwargs)
+            job = board_job(
+                guild, "weather", weather_channel_id, kwargs, board_hashes[relative],
+                on_board_sent(guild, weather_channel_id, claimed), release_all(claimed)
+            )
+            if job:
+                jobs.append(job)
+            continue
+        for w, weather_key in claimed:
+            jobs.append(DeliveryJob(
+                guild, weather_channel_id,
+                {"embed": render_cache.weather_embed(w, relative), "view": create_invite_view()},
+                on_weather_sent(guild, weather_channel_id, w, weather_key),
+                on_failed=release_all([(w, weather_key)])
+            ))
+
+    queued_at = time.time()
+    for start_ts in queued_starts:
+        trace = tracer.trace("weather", start_ts)
+        trace.mark("rendered", queued_at)
+        trace.mark("queued", queued_at)
+    await delivery.fan_out("weather", jobs)
+
+# --- Value Calculator ---
+# Fruits, mutations and variants ship in game_data.json; fruits may list "aliases"
+GAME_DATA_FILE = os.getenv("GAME_DATA_FILE", os.path.join(os.path.dirname(os.path.abspath(__file__)), "game_data.json"))
+CALC_BATCH_LIMIT = 200     # inventory entries per /calculatebatch
+CALC_BATCH_SHOWN = 20      # entries listed in its reply
+
+# Lowercase, punctuation dropped, words joined by "_" ("Orange Tulip" -> "orange_tulip")
+def normalize_name(text):
+    return "_".join("".join(c if c.isalnum() else " " for c in text.lower()).split())
+
+class ValueCalculator:
+    """Item values from the game data, indexed for lookups and batch pricing.
+
+    Fruits are found by normalized id, display name or alias. A sorted key
+    list (every name, and every name from each later word on, so "tulip"
+    finds Orange Tulip) answers autocomplete prefixes with bisect. Base
+    values and weight divisors are NumPy arrays and stacked mutations add
+    up their bonuses (1 + sum of multiplier - 1), so a whole inventory is
+    priced in one vectorized pass.
+    """
+
+    def __init__(self, data):
+        self.fruits = data["fruits"]
+        self.names = {}  # normalized id / name / alias -> fruit index
+        for i, fruit in enumerate(self.fruits):
+            for name in (fruit["item_id"], fruit["display_name"], *fruit.get("aliases", ())):
+                self.names.setdefault(normalize_name(name), i)
+        keys = set()
+        for name, i in self.names.items():
+            words = name.split("_")
+            keys.update(("_".join(words[w:]), i) for w in range(len(words)))
+        self.prefix_keys = sorted(keys)
+        self.base = np.array([f["baseValue"] for f in self.fruits], dtype=np.float64)
+        self.divisor = np.array([f["weightDivisor"] for f in self.fruits], dtype=np.float64)
+
+        self.mutation_names = [m["display_name"] for m in data["mutations"]]
+        self.mutation_bonus = np.array([m["multiplier"] - 1 for m in data["mutations"]], dtype=np.float64)
+        self.mutations = {}  # normalized id / name -> mutation index
+        for k, m in enumerate(data["mutations"]):
+            self.mutations.setdefault(normalize_name(m["mutation_id"]), k)
+            self.mutations.setdefault(normalize_name(m["display_name"]), k)
+        self.variants = {}   # normalized id / name -> (display name, multiplier)
+        for v in data["variants"]:
+            for name in (v["variant_id"], v["display_name"]):
+                self.variants.setdefault(normalize_name(name), (v["display_name"], v["multiplier"]))
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "r") as f:
+            return cls(json.load(f))
+
+    def find(self, name):
+        """Fruit index for a name, id or alias, None if unknown"""
+        return self.names.get(normalize_name(name))
+
+    def complete(self, text, limit=25):
+        """Indexes of fruits with a name (or a later word of one) starting with text"""
+        query = normalize_name(text)
+        found = []
+        i = bisect.bisect_left(self.prefix_keys, (query,))
+        while i < len(self.prefix_keys) and len(found) < limit:
+            key, fruit = self.prefix_keys[i]
+            if not key.startswith(query):
+                break
+            if fruit not in found:
+                found.append(fruit)
+            i += 1
+        return found
+
+    def find_variant(self, name):
+        """(display name, multiplier) of a variant, None if unknown"""
+        return self.variants.get(normalize_name(name))
+
+    def find_mutations(self, names):
+        """Mutation indexes for names; raises ValueError on an unknown one"""
+        found = []
+        for name in names:
+            key = normalize_name(name)
+            if not key:
                 continue
-            
-            weather_id = w.get("weather_id")
-            if not weather_id:
+            if key not in self.mutations:
+                raise ValueError(f"unknown mutation '{name.strip()}'")
+            if self.mutations[key] not in found:
+                found.append(self.mutations[key])
+        return found
+
+    def modifiers(self, tokens):
+        """(variant name, variant multiplier, mutation indexes) for names like
+        "gold", "windstruck"; raises ValueError on an unknown or second variant"""
+        variant = None
+        mutations = []
+        for token in tokens:
+            name = normalize_name(token)
+            if not name:
                 continue
-                
-            start_ts = w.get("start_duration_unix", 0)
-            active = w.get("active", False)
-            
-            if not active:
+            if name in self.mutations:
+                if self.mutations[name] not in mutations:
+                    mutations.append(self.mutations[name])
+            elif name in self.variants:
+                if variant is not None and variant != self.variants[name]:
+                    raise ValueError(f"only one variant is allowed ('{variant[0]}' and '{token}')")
+                variant = self.variants[name]
+            else:
+                raise ValueError(f"unknown mutation or variant '{token}'")
+        name, multiplier = variant or self.variants.get("normal", ("Normal", 1))
+        return name, multiplier, mutations
+
+    def mutation_multiplier(self, mutations):
+        return 1 + float(self.mutation_bonus[mutations].sum())
+
+    def price(self, fruits, weights, variant_multipliers, mutations):
+        """Values of many items at once; mutations is one list of indexes per item"""
+        fruits = np.asarray(fruits, dtype=np.intp)
+        stacked = np.zeros((len(fruits), len(self.mutation_bonus)), dtype=np.float64)
+        rows = [r for r, found in enumerate(mutations) for _ in found]
+        cols = [k for found in mutations for k in found]
+        stacked[rows, cols] = 1
+        values = (
+            self.base[fruits] * (np.asarray(weights, dtype=np.float64) / self.divisor[fruits])
+            * np.asarray(variant_multipliers, dtype=np.float64) * (1 + stacked @ self.mutation_bonus)
+        )
+        return np.round(values, 2)
+
+    def parse_entry(self, text):
+        """One inventory entry, "<item> <weight>[kg] [xN] [variant] [mutations...]".
+
+        Returns (fruit, weight, count, variant name, variant multiplier,
+        mutation indexes); raises ValueError when it cannot be priced.
+        """
+        tokens = text.replace(",", " ").replace("+", " ").split()
+        for w, token in enumerate(tokens):
+            try:
+                weight = float(token.lower().removesuffix("kg"))
+            except ValueError:
                 continue
-                
-            async with state_lock:
-                weather_key = f"{guild.id}_{weather_id}"
-                stored_start = last_state["weather"].get(weather_key, 0)
-                
-                if start_ts != stored_start:
-                    embed = create_weather_embed(w)
-                    ch = bot.get_channel(weather_channel_id)
-                    if ch:
-                        msg = await ch.send(embed=embed, view=create_invite_view())
-                        weather_name = w.get("weather_name", "Unknown Weather")
-                        server_name = guild.name
-                        logging.info(f"✅ Sent {'RESTART ' if is_restart else ''}weather event: {weather_name} to {server_name}")
-                        
-                        active_events["weather"][weather_key] = {
-                            "message_id": msg.id,
-                            "channel_id": weather_channel_id,
-                            "weather": w,
-                            "guild_id": guild.id
-                        }
-                        
-                        last_state["weather"][weather_key] = start_ts
-                        new_events_count += 1
-    
-    if new_events_count > 0:
-        save_last_state()
+            break
+        else:
+            raise ValueError("no weight")
+        fruit = self.find(" ".join(tokens[:w]))
+        if fruit is None:
+            raise ValueError(f"unknown item '{' '.join(tokens[:w])}'")
+        if not math.isfinite(weight) or weight <= 0:
+            raise ValueError("weight must be a positive number")
+        count = 1
+        rest = []
+        for token in tokens[w + 1:]:
+            digits = token.lower().strip("x")
+            if token.lower() != digits and digits.isdigit():
+                count = int(digits)
+                if count < 1:
+                    raise ValueError("count must be at least 1")
+            else:
+                rest.append(token)
+        return (fruit, weight, count, *self.modifiers(rest))
+
+calculator = ValueCalculator.load(GAME_DATA_FILE)
 
-# Full Data definitions (fruits, mutations, variants)
-DATA = {
-    "fruits": [
-        {"item_id":"carrot","display_name":"Carrot","baseValue":20,"weightDivisor":0.275},
-        {"item_id":"strawberry","display_name":"Strawberry","baseValue":15,"weightDivisor":0.3},
-        {"item_id":"blueberry","display_name":"Blueberry","baseValue":20,"weightDivisor":0.2},
-        {"item_id":"orange_tulip","display_name":"Orange Tulip","baseValue":850,"weightDivisor":0.05},
-        {"item_id":"tomato","display_name":"Tomato","baseValue":30,"weightDivisor":0.5},
-        {"item_id":"corn","display_name":"Corn","baseValue":40,"weightDivisor":2},
-        {"item_id":"daffodil","display_name":"Daffodil","baseValue":1000,"weightDivisor":0.2},
-        {"item_id":"watermelon","display_name":"Watermelon","baseValue":3000,"weightDivisor":7},
-        {"item_id":"pumpkin","display_name":"Pumpkin","baseValue":3400,"weightDivisor":8},
-        {"item_id":"apple","display_name":"Apple","baseValue":275,"weightDivisor":3}
-    ],
-    "mutations": [
-        {"mutation_id":"windstruck","display_name":"Windstruck","multiplier":5},
-        {"mutation_id":"twisted","display_name":"Twisted","multiplier":5},
-        {"mutation_id":"voidtouched","display_name":"Voidtouched","multiplier":135},
-        {"mutation_id":"moonlit","display_name":"Moonlit","multiplier":2},
-        {"mutation_id":"pollinated","display_name":"Pollinated","multiplier":3}
-    ],
-    "variants": [
-        {"variant_id":"normal","display_name":"Normal","multiplier":1},
-        {"variant_id":"gold","display_name":"Gold","multiplier":20},
-        {"variant_id":"rainbow","display_name":"Rainbow","multiplier":50}
-    ]
-}
 
-# Lookup tables
-FRUIT_DATA = DATA["fruits"]
-MUTATIONS = {m["mutation_id"]: m["multiplier"] for m in DATA["mutations"]}
-VARIANTS = {v["variant_id"]: v["multiplier"] for v in DATA["variants"]}
+_ready_once = False
 
 @bot.event
 async def on_ready():
+    # on_ready fires again after every reconnect; only the first one sets things up
+    global _ready_once
     logging.info(f"✅ Logged in as {bot.user}")
+    if _ready_once:
+        return
+    _ready_once = True
+    
+    await sync_commands_if_changed()
+    
+    restored = restore_active_posts()
+    logging.info(f"♻️ Restored {restored} live posts from the checkpoint")
+    
+    # Check for active weather immediately on startup for all servers; shards
+    # get it from the snapshot the poller replays when they connect
+    if RUN_MODE != "shard":
+        await check_new_weather(is_restart=True)
+    
+    # Start background tasks; shards get their snapshots from the poller
+    if RUN_MODE == "shard":
+        asyncio.create_task(follow_poller(on_poller_snapshot))
+    else:
+        fetch_updates.start()
+        frequent_checks.start()
+    update_active_events.start()
+    flush_state.start()
+    logging.info("🚀 Background tasks started")
+    
+    await start_metrics_server()
+
+def command_signature_hash():
+    """Hash of the slash command tree as Discord sees it, plus the application it belongs to"""
+    payload = sorted((cmd.to_dict(bot.tree) for cmd in bot.tree.get_commands()), key=lambda c: c["name"])
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(str(bot.application_id).encode())
+    digest.update(json.dumps(payload, sort_keys=True, default=str).encode())
+    return digest.hexdigest()
+
+async def sync_commands_if_changed():
+    """Sync the command tree only when it differs from the last synced one"""
+    signature = command_signature_hash()
+    if state_store.load_scope("meta").get("command_hash") == signature:
+        logging.info("🔄 Slash commands unchanged, skipping sync")
+        return
     try:
         await bot.tree.sync()
         logging.info("🔄 Slash commands synced")
     except Exception as e:
         logging.error(f"⚠️ Sync error: {e}")
-    
-    # Check for active weather immediately on startup for all servers
-    await check_new_weather(is_restart=True)
-    
-    # Start background tasks
-    fetch_updates.start()
-    update_active_events.start()
-    frequent_checks.start()
-    logging.info("🚀 Background tasks started")
+        return
+    state_store.put("meta", "command_hash", signature)
 
-# Background tasks
-@tasks.loop(minutes=5)
-async def fetch_updates():
-    """Check for new stock every 5 minutes"""
-    logging.info("🔍 Running 5-minute stock checks...")
-    async with aiohttp.ClientSession() as session:
-        try:
-            async with session.get(STOCK_API_URL) as r:
-                if r.status == 200 and r.content_type == 'application/json':
-                    raw = await r.json()
-                    stock = raw[0] if isinstance(raw, list) else raw
-                else:
-                    return
-        except Exception as e:
-            logging.error(f"⚠️ Stock API Error: {e}")
-            return
+@bot.event
+async def on_guild_join(guild):
+    index_guild(guild.id)
+    logging.info(f"➕ Joined {guild.name}")
+
+@bot.event
+async def on_guild_remove(guild):
+    unindex_guild(guild.id)
+    logging.info(f"➖ Left {guild.name}")
+
+def refresh_active_posts(snapshot):
+    """Queue in-place edits of live posts after a change within the same rotation"""
+    render_cache.invalidate(snapshot.category)
+    now = datetime.now(timezone.utc).timestamp()
+    for key, post in active_events["stock"].items():
+        shown = snapshot_store.get(post.snapshot_id)
+        if shown is not snapshot and shown.category == snapshot.category and shown.start_ts == snapshot.start_ts:
+            snapshot_store.acquire(snapshot.id)
+            snapshot_store.release(post.snapshot_id)
+            post.snapshot_id = snapshot.id
+            post.rendered = None
+            post.next_edit_at = now
+            countdown_timers.schedule(now, "stock", key)
+            checkpoint_post("stock", key, post)
+
+async def check_new_stock(snapshot=None):
+    """Check for new stock and post it to subscribed channels.
+
+    snapshot is a (status, data) pair already fetched by the poller process.
+    """
+    logging.info("🔍 Running stock checks...")
+    scheduled_at = min(stock_planner.next_poll_at or time.time(), time.time())
+    try:
+        status, raw = snapshot or await snapshot_cache.refresh(STOCK_API_URL)
+    except Exception as e:
+        logging.error(f"⚠️ Stock API Error: {e}")
+        stock_planner.record_error()
+        return
+    if raw is None:
+        stock_planner.record_error()
+        return
+    fetched_at = time.time()
+    stock = raw[0] if isinstance(raw, list) else raw
 
     # Check all stock categories for each server
     stock_categories = [
@@ -444,178 +3094,477 @@ async def fetch_updates():
         ("eventshop_stock", "Event Stock 🎉", "event_stock"),
     ]
 
-    for guild in bot.guilds:
-        for api_key, title, state_key in stock_categories:
-            chan_id = get_channel_for_server(guild.id, state_key)
-            if not chan_id:
+    def on_stock_sent(guild, chan_id, server_state_key, snapshot, relative):
+        def record(msg):
+            logging.info(f"✅ Sent new {snapshot.category} stock to {guild.name}")
+            track_event("stock", server_state_key, ActivePost(
+                guild.id, snapshot.id, chan_id, msg.id, relative, countdown_text(snapshot.expires_at),
+                getattr(msg, "webhook_id", None)
+            ))
+            stock_claims.commit(server_state_key, snapshot.start_ts)
+            tracer.sent(snapshot.category, snapshot.start_ts, guild.id)
+        return record
+
+    # One fan-out per category, all categories delivered concurrently
+    jobs_by_category = {state_key: [] for _, _, state_key in stock_categories}
+    rotations = {}
+    watched = []  # (snapshot, items) that watchers should hear about
+    for api_key, title, state_key in stock_categories:
+        snapshot = snapshot_store.stock(state_key, title, stock.get(api_key, []))
+        if snapshot is None:
+            continue
+        start_ts = snapshot.start_ts
+        rotations[state_key] = start_ts
+        trace = tracer.trace(state_key, start_ts)
+        trace.mark("scheduled", scheduled_at)
+        trace.mark("fetched", fetched_at)
+        trace.mark("parsed")
+        
+        diff = stock_differ.diff(snapshot)
+        trace.mark("diffed")
+        if diff is not None:
+            stock_archive.record(state_key, start_ts, snapshot.end_ts, [
+                (item.item_id, item.name, item.price, item.quantity) for item in snapshot.items
+            ])
+        if diff is not None and not diff.new_rotation:
+            logging.info(f"🔄 {state_key} stock changed within its rotation ({diff.summary()})")
+            refresh_active_posts(snapshot)
+            if diff.added:
+                watched.append((snapshot, list(diff.added.values())))
+        elif diff is not None and start_ts > last_state.get(f"watch_{state_key}", 0):
+            # New rotation; the stored start stops a restart from notifying twice
+            watched.append((snapshot, snapshot.items))
+            set_last_state(f"watch_{state_key}", start_ts)
+        
+        # Servers whose filter no item passes are skipped before rendering
+        matched = item_filters.match(snapshot.items)
+        filtered = 0
+        board_hashes = {}  # relative -> hash of this rotation's embed
+        
+        # Unchanged snapshots only need to reach servers that just subscribed
+        for guild, chan_id in iter_subscribers(state_key, only_new=diff is None):
+            if not item_filters.allows(guild.id, matched):
+                filtered += 1
                 continue
-                
-            items = stock.get(api_key, [])
-            if items:
-                start_ts = max(i.get("start_date_unix", 0) for i in items)
-                end_ts = max(i.get("end_date_unix", 0) for i in items)
-                
-                server_state_key = f"{guild.id}_{state_key}"
-                if start_ts > last_state.get(server_state_key, 0):
-                    embed = create_stock_embed(items, title, start_ts, end_ts)
-                    ch = bot.get_channel(chan_id)
-                    if ch:
-                        msg = await ch.send(embed=embed, view=create_invite_view())
-                        server_name = guild.name
-                        logging.info(f"✅ Sent new {state_key} stock to {server_name}")
-                        
-                        active_events["stock"][server_state_key] = {
-                            "message_id": msg.id,
-                            "channel_id": chan_id,
-                            "start_ts": start_ts,
-                            "end_ts": end_ts,
-                            "items": items,
-                            "title": title,
-                            "guild_id": guild.id
-                        }
-                        last_state[server_state_key] = start_ts
-
-    save_last_state()
+            server_state_key = f"{guild.id}_{state_key}"
+            if stock_claims.claim(server_state_key, start_ts):
+                relative = uses_relative_countdown(guild.id)
+                kwargs = {"embed": render_cache.stock_embed(snapshot, relative), "view": create_invite_view()}
+                on_sent = on_stock_sent(guild, chan_id, server_state_key, snapshot, relative)
+                on_failed = lambda key=server_state_key, start_ts=start_ts: stock_claims.release(key, start_ts)
+                if uses_live_board(guild.id):
+                    if relative not in board_hashes:
+                        board_hashes[relative] = embed_hash(kwargs)
+                    job = board_job(guild, state_key, chan_id, kwargs, board_hashes[relative], on_sent, on_failed)
+                else:
+                    job = DeliveryJob(guild, chan_id, kwargs, on_sent, on_failed=on_failed)
+                if job:
+                    jobs_by_category[state_key].append(job)
+        if filtered:
+            metrics.inc("stock_posts_filtered_total", filtered, category=state_key)
+        if jobs_by_category[state_key]:
+            trace.mark("rendered")
+
+    # Next poll lands just after the earliest category rotation
+    now = datetime.now(timezone.utc).timestamp()
+    stock_planner.record(*stock_poll_hint(raw, now), now)
+
+    queued_at = time.time()
+    for state_key, start_ts in rotations.items():
+        if jobs_by_category[state_key]:
+            tracer.trace(state_key, start_ts).mark("queued", queued_at)
+
+    start_watch_notifications(watched)
+    await asyncio.gather(*(
+        delivery.fan_out(f"{state_key} stock", jobs)
+        for state_key, jobs in jobs_by_category.items()
+    ))
+
+# Background tasks
+@tasks.loop(minutes=5)
+async def fetch_updates():
+    """Poll stock, then reschedule around the next expected rotation"""
+    with metrics.track_loop("fetch_updates", fetch_updates):
+        await check_new_stock()
+    fetch_updates.change_interval(seconds=stock_planner.delay)
 
 @tasks.loop(seconds=20)
 async def frequent_checks():
-    """Check for new weather and announcements every 20 seconds"""
+    """Poll weather, then reschedule around the next expected change"""
     # Check if any server has weather channels configured
-    has_weather_channels = any(
-        get_channel_for_server(guild.id, "weather") 
-        for guild in bot.guilds
-    )
-    if has_weather_channels:
-        await check_new_weather()
+    if subscriptions["weather"]:
+        with metrics.track_loop("frequent_checks", frequent_checks):
+            await check_new_weather()
+        frequent_checks.change_interval(seconds=weather_planner.delay)
+
+@tasks.loop(seconds=2)
+async def flush_state():
+    """Write-behind commit of queued config and last-state changes"""
+    with metrics.track_loop("flush_state", flush_state):
+        await stock_archive.flush()
+        await state_store.flush()
+
+async def edit_countdown(key, post, snapshot, text):
+    """Edit one countdown message in place, without fetching it first"""
+    channel = bot.get_partial_messageable(post.channel_id)
+    message = channel.get_partial_message(post.message_id)
+    embed = render_cache.stock_embed(snapshot, post.relative)
+    # Edit through the route that sent the message; only that webhook can edit it
+    hook = None
+    if post.webhook_id is not None:
+        hook = channel_webhooks.get(post.channel_id)
+        if hook is None or hook.id != post.webhook_id:
+            drop_event("stock", key)  # Its webhook was deleted
+            return
+    if hook:
+        await channel_webhooks.bucket(hook).acquire()
+    else:
+        await delivery.global_bucket.acquire()
+    request_start = time.perf_counter()
+    try:
+        if hook:
+            await hook.edit_message(post.message_id, embed=embed)
+        else:
+            await message.edit(embed=embed)
+    except (discord.NotFound, discord.Forbidden) as e:
+        if hook and getattr(e, "code", None) == UNKNOWN_WEBHOOK:
+            channel_webhooks.forget(post.channel_id)
+        drop_event("stock", key)
+        return
+    except Exception as e:
+        if isinstance(e, discord.RateLimited) or getattr(e, "status", None) == 429:
+            metrics.inc("discord_rate_limited_total", op="edit")
+        # Leave the post stale and try again next tick
+        logging.debug(f"Countdown edit failed for {key}: {e}")
+        now = datetime.now(timezone.utc).timestamp()
+        post.next_edit_at = now + COUNTDOWN_TICK_SECONDS
+        countdown_timers.schedule(post.next_edit_at, "stock", key)
+        return
+    finally:
+        metrics.observe("discord_request_seconds", time.perf_counter() - request_start, op="edit")
+    metrics.inc("discord_requests_total", op="edit")
+    post.rendered = text
+    if post.relative:
+        return  # Discord counts these down itself
+    now = datetime.now(timezone.utc).timestamp()
+    post.next_edit_at = next_countdown_change(snapshot.expires_at, now)
+    countdown_timers.schedule(post.next_edit_at, "stock", key)
 
-@tasks.loop(seconds=5)
+@tasks.loop(seconds=COUNTDOWN_TICK_SECONDS)
 async def update_active_events():
-    """Update active events every 5 seconds"""
+    """Expire finished events and edit countdowns whose text changed"""
+    with metrics.track_loop("update_active_events", update_active_events):
+        await run_countdown_tick()
+
+async def run_countdown_tick():
     current_utc = datetime.now(timezone.utc).timestamp()
+    expire_events(current_utc)
     
-    # Update stock events
-    for key, event in list(active_events["stock"].items()):
-        try:
-            if event["end_ts"] <= current_utc:
-                del active_events["stock"][key]
-                continue
-                
-            channel = bot.get_channel(event["channel_id"])
-            if channel:
-                message = await channel.fetch_message(event["message_id"])
-                embed = create_stock_embed(
-                    event["items"], event["title"], 
-                    event["start_ts"], event["end_ts"]
-                )
-                await message.edit(embed=embed)
-        except (discord.NotFound, Exception):
-            if key in active_events["stock"]:
-                del active_events["stock"][key]
+    # Spend at most this tick's share of the per-minute budget; timers are
+    # popped in due order so the longest-stale countdowns go first
+    per_tick = max(1, EDIT_BUDGET_PER_MINUTE * COUNTDOWN_TICK_SECONDS // 60)
+    due = []
+    for when, kind, key in countdown_timers.pop_due(current_utc, per_tick):
+        post = active_events["stock"].get(key)
+        if post is None or post.next_edit_at != when:
+            continue
+        snapshot = snapshot_store.get(post.snapshot_id)
+        text = countdown_text(snapshot.expires_at, current_utc)
+        if text is None:
+            continue
+        if text == post.rendered:
+            post.next_edit_at = next_countdown_change(snapshot.expires_at, current_utc)
+            countdown_timers.schedule(post.next_edit_at, "stock", key)
+            continue
+        due.append(edit_countdown(key, post, snapshot, text))
+    await asyncio.gather(*due)
 
 # Slash Commands
 
+async def calculate_item_autocomplete(interaction: discord.Interaction, current: str):
+    return [
+        app_commands.Choice(name=calculator.fruits[i]["display_name"], value=calculator.fruits[i]["item_id"])
+        for i in calculator.complete(current)
+    ]
+
+async def calculate_mutation_autocomplete(interaction: discord.Interaction, current: str):
+    # Completes the last of the comma-separated mutations typed so far
+    done, _, last = current.rpartition(",")
+    prefix = f"{done}, " if done else ""
+    query = normalize_name(last)
+    return [
+        app_commands.Choice(name=(prefix + name)[:100], value=(prefix + name)[:100])
+        for name in calculator.mutation_names if normalize_name(name).startswith(query)
+    ][:25]
+
+async def calculate_variant_autocomplete(interaction: discord.Interaction, current: str):
+    query = normalize_name(current)
+    names = sorted({name for name, _ in calculator.variants.values()})
+    return [app_commands.Choice(name=name, value=name) for name in names if normalize_name(name).startswith(query)][:25]
+
 @bot.tree.command(name="calculate", description="Calculate Grow a Garden item value")
 @app_commands.describe(
     item_name="Name or ID of the item",
     weight="Weight of the item",
-    mutation="Mutation type",
+    mutation="Mutations, comma-separated (e.g. windstruck, moonlit)",
     variant="Variant type"
 )
+@app_commands.autocomplete(
+    item_name=calculate_item_autocomplete,
+    mutation=calculate_mutation_autocomplete,
+    variant=calculate_variant_autocomplete
+)
 async def calculate(
     interaction: discord.Interaction,
     item_name: str,
     weight: float,
-    mutation: str = "normal",
+    mutation: str = None,
     variant: str = "normal"
 ):
-    item_name = item_name.lower()
-    fruit = next(
-        (f for f in FRUIT_DATA if f["item_id"] == item_name or f["display_name"].lower() == item_name),
-        None
-    )
-    
-    if not fruit:
+    fruit = calculator.find(item_name)
+    if fruit is None:
         await interaction.response.send_message(f"❌ Item '{item_name}' not found.", ephemeral=True)
         return
-
-    mut_mult = MUTATIONS.get(mutation.lower(), 1)
-    var_mult = VARIANTS.get(variant.lower(), 1)
+    if not math.isfinite(weight) or weight <= 0:
+        await interaction.response.send_message("❌ Weight must be a positive number.", ephemeral=True)
+        return
+    found = calculator.find_variant(variant)
+    if found is None:
+        await interaction.response.send_message(f"❌ Unknown variant '{variant}'.", ephemeral=True)
+        return
+    variant_name, variant_mult = found
+    try:
+        mutations = calculator.find_mutations((mutation or "").split(","))
+    except ValueError as e:
+        await interaction.response.send_message(f"❌ {str(e).capitalize()}.", ephemeral=True)
+        return
     
-    base = fruit["baseValue"]
-    div = fruit["weightDivisor"]
-    value = round(base * (weight / div) * mut_mult * var_mult, 2)
+    value = float(calculator.price([fruit], [weight], [variant_mult], [mutations])[0])
+    mutation_text = " + ".join(calculator.mutation_names[k] for k in mutations) or "None"
+    if len(mutations) > 1:
+        mutation_text += f" (×{calculator.mutation_multiplier(mutations):g})"
 
     embed = discord.Embed(title="🧮 Item Value Calculator", color=discord.Color.purple())
-    embed.add_field(name="Item", value=fruit["display_name"], inline=True)
+    embed.add_field(name="Item", value=calculator.fruits[fruit]["display_name"], inline=True)
     embed.add_field(name="Weight", value=weight, inline=True)
-    embed.add_field(name="Mutation", value=mutation.title(), inline=True)
-    embed.add_field(name="Variant", value=variant.title(), inline=True)
+    embed.add_field(name="Mutation", value=mutation_text, inline=True)
+    embed.add_field(name="Variant", value=variant_name, inline=True)
     embed.add_field(name="Calculated Value", value=f"${value:,.2f}", inline=False)
     
     await interaction.response.send_message(embed=embed)
 
+@bot.tree.command(name="calculatebatch", description="Value a whole inventory at once")
+@app_commands.describe(
+    inventory="Entries separated by ';', e.g. carrot 2.5 gold windstruck; apple 3kg x4 moonlit+pollinated"
+)
+async def calculate_batch(interaction: discord.Interaction, inventory: str):
+    entries = [entry.strip() for entry in inventory.replace("\n", ";").split(";") if entry.strip()]
+    if not entries:
+        await interaction.response.send_message("❌ Please list at least one item.", ephemeral=True)
+        return
+    if len(entries) > CALC_BATCH_LIMIT:
+        await interaction.response.send_message(f"❌ At most {CALC_BATCH_LIMIT} entries per call.", ephemeral=True)
+        return
+    
+    parsed, errors = [], []
+    for n, entry in enumerate(entries, 1):
+        try:
+            parsed.append((entry, *calculator.parse_entry(entry)))
+        except ValueError as e:
+            errors.append(f"{n}. `{entry[:40]}`: {e}")
+    if not parsed:
+        await interaction.response.send_message("❌ No entry could be valued:\n" + "\n".join(errors[:10]), ephemeral=True)
+        return
+    
+    _, fruits, weights, counts, _, variant_mults, mutations = zip(*parsed)
+    values = calculator.price(fruits, weights, variant_mults, mutations) * np.asarray(counts)
+    total = float(values.sum())
+    
+    lines = []
+    for (entry, fruit, weight, count, variant_name, _, found), value in zip(parsed[:CALC_BATCH_SHOWN], values):
+        tags = [variant_name] if variant_name != "Normal" else []
+        tags += [calculator.mutation_names[k] for k in found]
+        amount = f"{count}× " if count > 1 else ""
+        lines.append(
+            f"{amount}**{calculator.fruits[fruit]['display_name']}** {weight:g}kg"
+            f"{' · ' + ', '.join(tags) if tags else ''} → ${float(value):,.2f}"
+        )
+    if len(parsed) > CALC_BATCH_SHOWN:
+        lines.append(f"…and {len(parsed) - CALC_BATCH_SHOWN} more")
+
+    embed = discord.Embed(title="🧮 Inventory Value", description="\n".join(lines), color=discord.Color.purple())
+    embed.add_field(name="Items Valued", value=f"{int(sum(counts)):,}", inline=True)
+    embed.add_field(name="Total Value", value=f"${total:,.2f}", inline=True)
+    if errors:
+        more = f"\n…and {len(errors) - 10} more" if len(errors) > 10 else ""
+        embed.add_field(name="⚠️ Skipped", value="\n".join(errors[:10])[:1000] + more, inline=False)
+    
+    await interaction.response.send_message(embed=embed)
+
+# Optional "delivery" option shared by the /set channel commands
+DELIVERY_CHOICES = [
+    app_commands.Choice(name="Bot messages", value="bot"),
+    app_commands.Choice(name="Channel webhook (own rate limits)", value="webhook")
+]
+DELIVERY_DESCRIBE = "bot: post as the bot, webhook: post through a webhook in each channel (needs Manage Webhooks)"
+
+def set_delivery(interaction, delivery):
+    """Apply a /set command's delivery choice; returns a note for the reply.
+
+    The webhook itself is created on the first send, so the reply never
+    waits on a Discord API call; only the permission is checked here.
+    """
+    if delivery is None:
+        return ""
+    config = get_server_config(interaction.guild.id, create=True)
+    config["delivery"] = delivery.value
+    save_server_config(interaction.guild.id)
+    if delivery.value == "webhook":
+        channel_webhooks.create_failed.pop(interaction.channel.id, None)
+        if not interaction.channel.permissions_for(interaction.guild.me).manage_webhooks:
+            return "\n⚠️ I need the Manage Webhooks permission here, posting as the bot until I have it."
+    return f"\n📨 Posts are delivered as **{delivery.name}**"
+
 @bot.tree.command(name="setseed", description="Set seed stock channel (Admin only)")
-async def set_seed(interaction: discord.Interaction):
+@app_commands.describe(delivery=DELIVERY_DESCRIBE)
+@app_commands.choices(delivery=DELIVERY_CHOICES)
+async def set_seed(interaction: discord.Interaction, delivery: app_commands.Choice[str] = None):
     if not interaction.user.guild_permissions.administrator:
         await interaction.response.send_message("❌ Admin only.", ephemeral=True)
         return
     
     update_server_config(interaction.guild.id, interaction.guild.name, "seed", interaction.channel.id)
-    await interaction.response.send_message(f"✅ Seed stock channel set to {interaction.channel.mention}")
+    note = set_delivery(interaction, delivery)
+    await interaction.response.send_message(f"✅ Seed stock channel set to {interaction.channel.mention}{note}")
 
 @bot.tree.command(name="setgear", description="Set gear stock channel (Admin only)")
-async def set_gear(interaction: discord.Interaction):
+@app_commands.describe(delivery=DELIVERY_DESCRIBE)
+@app_commands.choices(delivery=DELIVERY_CHOICES)
+async def set_gear(interaction: discord.Interaction, delivery: app_commands.Choice[str] = None):
     if not interaction.user.guild_permissions.administrator:
         await interaction.response.send_message("❌ Admin only.", ephemeral=True)
         return
     
     update_server_config(interaction.guild.id, interaction.guild.name, "gear", interaction.channel.id)
-    await interaction.response.send_message(f"✅ Gear stock channel set to {interaction.channel.mention}")
+    note = set_delivery(interaction, delivery)
+    await interaction.response.send_message(f"✅ Gear stock channel set to {interaction.channel.mention}{note}")
 
 @bot.tree.command(name="setegg", description="Set egg stock channel (Admin only)")
-async def set_egg(interaction: discord.Interaction):
+@app_commands.describe(delivery=DELIVERY_DESCRIBE)
+@app_commands.choices(delivery=DELIVERY_CHOICES)
+async def set_egg(interaction: discord.Interaction, delivery: app_commands.Choice[str] = None):
     if not interaction.user.guild_permissions.administrator:
         await interaction.response.send_message("❌ Admin only.", ephemeral=True)
         return
     
     update_server_config(interaction.guild.id, interaction.guild.name, "egg", interaction.channel.id)
-    await interaction.response.send_message(f"✅ Egg stock channel set to {interaction.channel.mention}")
+    note = set_delivery(interaction, delivery)
+    await interaction.response.send_message(f"✅ Egg stock channel set to {interaction.channel.mention}{note}")
 
 @bot.tree.command(name="setcosmetic", description="Set cosmetic stock channel (Admin only)")
-async def set_cosmetic(interaction: discord.Interaction):
+@app_commands.describe(delivery=DELIVERY_DESCRIBE)
+@app_commands.choices(delivery=DELIVERY_CHOICES)
+async def set_cosmetic(interaction: discord.Interaction, delivery: app_commands.Choice[str] = None):
     if not interaction.user.guild_permissions.administrator:
         await interaction.response.send_message("❌ Admin only.", ephemeral=True)
         return
     
     update_server_config(interaction.guild.id, interaction.guild.name, "cosmetic", interaction.channel.id)
-    await interaction.response.send_message(f"✅ Cosmetic stock channel set to {interaction.channel.mention}")
+    note = set_delivery(interaction, delivery)
+    await interaction.response.send_message(f"✅ Cosmetic stock channel set to {interaction.channel.mention}{note}")
 
 @bot.tree.command(name="seteventstock", description="Set event stock channel (Admin only)")
-async def set_event_stock(interaction: discord.Interaction):
+@app_commands.describe(delivery=DELIVERY_DESCRIBE)
+@app_commands.choices(delivery=DELIVERY_CHOICES)
+async def set_event_stock(interaction: discord.Interaction, delivery: app_commands.Choice[str] = None):
     if not interaction.user.guild_permissions.administrator:
         await interaction.response.send_message("❌ Admin only.", ephemeral=True)
         return
     
     update_server_config(interaction.guild.id, interaction.guild.name, "event_stock", interaction.channel.id)
-    await interaction.response.send_message(f"✅ Event stock channel set to {interaction.channel.mention}")
+    note = set_delivery(interaction, delivery)
+    await interaction.response.send_message(f"✅ Event stock channel set to {interaction.channel.mention}{note}")
 
 @bot.tree.command(name="setannounce", description="Set announcements channel (Admin only)")
-async def set_announce(interaction: discord.Interaction):
+@app_commands.describe(delivery=DELIVERY_DESCRIBE)
+@app_commands.choices(delivery=DELIVERY_CHOICES)
+async def set_announce(interaction: discord.Interaction, delivery: app_commands.Choice[str] = None):
     if not interaction.user.guild_permissions.administrator:
         await interaction.response.send_message("❌ Admin only.", ephemeral=True)
         return
     
     update_server_config(interaction.guild.id, interaction.guild.name, "announcement", interaction.channel.id)
-    await interaction.response.send_message(f"✅ Announcements channel set to {interaction.channel.mention}")
+    note = set_delivery(interaction, delivery)
+    await interaction.response.send_message(f"✅ Announcements channel set to {interaction.channel.mention}{note}")
 
 @bot.tree.command(name="setweather", description="Set weather channel (Admin only)")
-async def set_weather(interaction: discord.Interaction):
+@app_commands.describe(delivery=DELIVERY_DESCRIBE)
+@app_commands.choices(delivery=DELIVERY_CHOICES)
+async def set_weather(interaction: discord.Interaction, delivery: app_commands.Choice[str] = None):
     if not interaction.user.guild_permissions.administrator:
         await interaction.response.send_message("❌ Admin only.", ephemeral=True)
         return
     
     update_server_config(interaction.guild.id, interaction.guild.name, "weather", interaction.channel.id)
-    await interaction.response.send_message(f"✅ Weather channel set to {interaction.channel.mention}")
+    note = set_delivery(interaction, delivery)
+    await interaction.response.send_message(f"✅ Weather channel set to {interaction.channel.mention}{note}")
+
+@bot.tree.command(name="setcountdown", description="Choose how countdowns are shown (Admin only)")
+@app_commands.describe(mode="edit: bot updates the message every minute, timestamp: Discord counts down itself")
+@app_commands.choices(mode=[
+    app_commands.Choice(name="Edited countdown", value="edit"),
+    app_commands.Choice(name="Discord timestamp", value="timestamp")
+])
+async def set_countdown(interaction: discord.Interaction, mode: app_commands.Choice[str]):
+    if not interaction.user.guild_permissions.administrator:
+        await interaction.response.send_message("❌ Admin only.", ephemeral=True)
+        return
+    
+    config = get_server_config(interaction.guild.id, create=True)
+    config["server_name"] = interaction.guild.name
+    config["countdown_mode"] = mode.value
+    save_server_config(interaction.guild.id)
+    await interaction.response.send_message(f"✅ Countdown mode set to **{mode.name}**")
+
+@bot.tree.command(name="setfilter", description="Only post stock that has items you care about (Admin only)")
+@app_commands.describe(
+    items="Comma-separated item IDs, e.g. carrot, bug_egg (empty: any item)",
+    min_price="Only items costing at least this much",
+    min_quantity="Only items with at least this many in stock"
+)
+async def set_filter(interaction: discord.Interaction, items: str = None, min_price: int = None, min_quantity: int = None):
+    if not interaction.user.guild_permissions.administrator:
+        await interaction.response.send_message("❌ Admin only.", ephemeral=True)
+        return
+    
+    item_ids = sorted({normalize_item_id(i) for i in (items or "").split(",") if i.strip()})
+    spec = {"items": item_ids, "min_price": max(0, min_price or 0), "min_quantity": max(0, min_quantity or 0)}
+    config = get_server_config(interaction.guild.id, create=True)
+    config["server_name"] = interaction.guild.name
+    config["filter"] = spec if FilterMatcher.compile_rule(spec) else None
+    index_guild(interaction.guild.id)
+    save_server_config(interaction.guild.id)
+    if config["filter"] is None:
+        await interaction.response.send_message("✅ Filter cleared, every stock rotation will be posted")
+    else:
+        await interaction.response.send_message(f"✅ Stock is only posted when an item matches: {describe_filter(spec)}")
+
+@bot.tree.command(name="setpostmode", description="Choose how stock and weather are posted (Admin only)")
+@app_commands.describe(mode="new: a new message every rotation, board: one pinned message per channel, edited in place")
+@app_commands.choices(mode=[
+    app_commands.Choice(name="New message each rotation", value="new"),
+    app_commands.Choice(name="Live board (one pinned message, edited)", value="board")
+])
+async def set_post_mode(interaction: discord.Interaction, mode: app_commands.Choice[str]):
+    if not interaction.user.guild_permissions.administrator:
+        await interaction.response.send_message("❌ Admin only.", ephemeral=True)
+        return
+    
+    config = get_server_config(interaction.guild.id, create=True)
+    config["server_name"] = interaction.guild.name
+    config["post_mode"] = mode.value
+    save_server_config(interaction.guild.id)
+    await interaction.response.send_message(f"✅ Post mode set to **{mode.name}**")
 
 @bot.tree.command(name="resetstock", description="Reset all stock channels (Admin only)")
 async def reset_stock(interaction: discord.Interaction):
@@ -633,7 +3582,8 @@ async def reset_stock(interaction: discord.Interaction):
         config["event_stock_channel_id"] = None
         config["announcement_channel_id"] = None
         config["weather_channel_id"] = None
-        save_channels()
+        unindex_guild(interaction.guild.id)
+        save_server_config(interaction.guild.id)
     
     await interaction.response.send_message("✅ All stock channels have been reset. Use the set commands to configure new channels.")
 
@@ -642,18 +3592,16 @@ async def ping_command(interaction: discord.Interaction):
     # Calculate bot latency
     bot_latency = round(bot.latency * 1000)
     
-    # Start timing for API test
-    start_time = time.time()
-    
-    await interaction.response.defer()
+    # Everything else comes from the metrics registry, no extra API request
+    def ms(hist, pct):
+        value = hist.quantile(pct)
+        return "N/A" if value is None else f"{value * 1000:.0f}ms"
     
-    # Test API latency
-    try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(STOCK_API_URL) as r:
-                api_latency = round((time.time() - start_time) * 1000)
-    except Exception:
-        api_latency = "N/A"
+    upstream = metrics.histogram("upstream_request_seconds", feed=STOCK_API_URL.rstrip("/").rsplit("/", 1)[-1])
+    sends = metrics.histogram("discord_request_seconds", op="send")
+    edits = metrics.histogram("discord_request_seconds", op="edit")
+    lag = metrics.histogram("event_loop_lag_seconds")
+    rate_limits = sum(v for (name, _), v in metrics.counters.items() if name == "discord_rate_limited_total")
     
     # Create embed
     embed = discord.Embed(
@@ -662,23 +3610,70 @@ async def ping_command(interaction: discord.Interaction):
         timestamp=datetime.now(timezone.utc)
     )
     embed.add_field(name="Bot Latency", value=f"{bot_latency}ms", inline=True)
-    embed.add_field(name="API Latency", value=f"{api_latency}ms" if api_latency != "N/A" else "N/A", inline=True)
+    embed.add_field(name="API Latency", value=f"{upstream.recent[-1] * 1000:.0f}ms" if upstream.recent else "N/A", inline=True)
+    embed.add_field(name="API p50 / p99", value=f"{ms(upstream, 50)} / {ms(upstream, 99)}", inline=True)
+    embed.add_field(name="Send p50 / p99", value=f"{ms(sends, 50)} / {ms(sends, 99)}", inline=True)
+    embed.add_field(name="Edit p50 / p99", value=f"{ms(edits, 50)} / {ms(edits, 99)}", inline=True)
+    embed.add_field(name="Loop Lag p99", value=ms(lag, 99), inline=True)
+    stats = http_client.stats
+    embed.add_field(
+        name="HTTP Pool",
+        value=(
+            f"{stats['requests']} requests, {stats['not_modified']} not modified\n"
+            f"{stats['connections_created']} opened, {stats['connections_reused']} reused"
+        ),
+        inline=False
+    )
+    embed.add_field(
+        name="Activity",
+        value=(
+            f"{len(active_events['stock'])} stock / {len(active_events['weather'])} weather posts live\n"
+            f"{rate_limits} rate limits hit"
+        ),
+        inline=False
+    )
     
-    await interaction.followup.send(embed=embed)
+    await interaction.response.send_message(embed=embed)
+
+@bot.tree.command(name="stats", description="Show how fresh stock and weather posts are (Admin only)")
+async def stats_command(interaction: discord.Interaction):
+    if not interaction.user.guild_permissions.administrator:
+        await interaction.response.send_message("❌ Admin only.", ephemeral=True)
+        return
+    
+    embed = discord.Embed(
+        title="⏱️ Freshness",
+        description="Seconds from rotation start to each stage, over recent rotations",
+        color=0x0099ff,
+        timestamp=datetime.now(timezone.utc)
+    )
+    for category in [*STOCK_CATEGORY_MAPPING, "weather"]:
+        traces = tracer.recent(category)
+        if not traces:
+            continue
+        lags = [lag for trace in traces for lag in trace.lags]
+        lines = [f"Lag p50 {percentile(lags, 50):.1f}s / p99 {percentile(lags, 99):.1f}s" if lags else "Nothing sent yet"]
+        lines.append(f"Latest: {traces[-1].report() or 'no stages yet'}")
+        mine = tracer.guild_lags.get((interaction.guild_id, category))
+        if mine:
+            lines.append(f"This server: {mine[1]:.1f}s <t:{int(mine[0])}:R>")
+        embed.add_field(name=category.replace("_", " ").title(), value="\n".join(lines)[:1024], inline=False)
+    if not embed.fields:
+        embed.description = "No rotations traced yet."
+    
+    await interaction.response.send_message(embed=embed, ephemeral=True)
 
 @bot.tree.command(name="stock", description="Show current stock information")
 async def stock_command(interaction: discord.Interaction):
     await interaction.response.defer()
     
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(STOCK_API_URL) as r:
-                if r.status == 200 and r.content_type == 'application/json':
-                    raw = await r.json()
-                    stock = raw[0] if isinstance(raw, list) else raw
-                else:
-                    await interaction.followup.send("❌ Unable to fetch stock data. Please try again later.")
-                    return
+        status, raw = await snapshot_cache.get(STOCK_API_URL)
+        if raw is None:
+            await interaction.followup.send("❌ Unable to fetch stock data. Please try again later.")
+            return
+        stale_age = snapshot_cache.age(STOCK_API_URL) if snapshot_cache.is_stale(STOCK_API_URL) else None
+        stock = raw[0] if isinstance(raw, list) else raw
     except Exception as e:
         await interaction.followup.send("❌ There was an error! Please try again later.")
         logging.error(f"Stock command API error: {e}")
@@ -726,7 +3721,262 @@ async def stock_command(interaction: discord.Interaction):
             inline=True
         )
     
+    # Upstream is down: say how old the snapshot we are showing is
+    if stale_age is not None:
+        embed.color = discord.Color.orange()
+        embed.description = f"⚠️ Stock API unavailable, showing data from <t:{int(time.time() - stale_age)}:R>."
+    
     await interaction.followup.send(embed=embed)
 
-# Run the bot
-bot.run(TOKEN)
+# Item ids for /watch: everything in the current stock plus anything already watched
+async def watch_item_autocomplete(interaction: discord.Interaction, current: str):
+    query = normalize_item_id(current)
+    known = {item_id: item_id for item_id in watch_index.by_item}
+    for snapshot in list(snapshot_store.current.values()):
+        for item in getattr(snapshot, "items", ()):
+            known[item.item_id] = item.name
+    return [
+        app_commands.Choice(name=f"{name} ({item_id})"[:100], value=item_id)
+        for item_id, name in sorted(known.items()) if query in item_id
+    ][:25]
+
+async def unwatch_item_autocomplete(interaction: discord.Interaction, current: str):
+    query = normalize_item_id(current)
+    entry = watch_index.get(interaction.user.id, interaction.guild_id)
+    items = sorted(entry["items"]) if entry else []
+    return [app_commands.Choice(name=item_id, value=item_id) for item_id in items if query in item_id][:25]
+
+@bot.tree.command(name="watch", description="Get notified when an item is in stock")
+@app_commands.describe(
+    item="Item ID, e.g. carrot",
+    notify="How to notify you (default: direct message)"
+)
+@app_commands.choices(notify=[
+    app_commands.Choice(name="Direct message", value="dm"),
+    app_commands.Choice(name="Mention in this server's stock channel", value="mention")
+])
+@app_commands.autocomplete(item=watch_item_autocomplete)
+async def watch_command(interaction: discord.Interaction, item: str, notify: app_commands.Choice[str] = None):
+    if interaction.guild is None:
+        await interaction.response.send_message("❌ Use this command in a server.", ephemeral=True)
+        return
+    
+    item_id = normalize_item_id(item)
+    if not item_id:
+        await interaction.response.send_message("❌ Please give an item ID.", ephemeral=True)
+        return
+    user_id = interaction.user.id
+    entry = watch_index.get(user_id, interaction.guild.id)
+    mode = notify.value if notify else (entry or {}).get("mode", "dm")
+    
+    # The DM channel id never changes, so open it once here instead of at notify time;
+    # that is an API call, so answer the interaction first
+    await interaction.response.defer(ephemeral=True)
+    dm_channel = interaction.user.dm_channel
+    if dm_channel is None:
+        try:
+            dm_channel = await interaction.user.create_dm()
+        except discord.HTTPException:
+            dm_channel = None
+    if mode == "dm" and dm_channel is None:
+        await interaction.followup.send("❌ I can't open a DM with you. Try `notify: Mention`.", ephemeral=True)
+        return
+    
+    if not watch_index.watch(user_id, item_id, mode, interaction.guild.id, dm_channel.id if dm_channel else None):
+        await interaction.followup.send(
+            f"❌ You can watch at most {WATCH_LIMIT_PER_USER} items per server. Use `/unwatch` first.", ephemeral=True
+        )
+        return
+    
+    items = sorted(watch_index.get(user_id, interaction.guild.id)["items"])
+    how = "a DM" if mode == "dm" else f"a mention in {interaction.guild.name}'s stock channel"
+    await interaction.followup.send(
+        f"🔔 Watching **{item_id}**. You'll get {how} when it is in stock.\n"
+        f"Your watchlist in this server ({len(items)}/{WATCH_LIMIT_PER_USER}): {', '.join(items)}",
+        ephemeral=True
+    )
+
+@bot.tree.command(name="unwatch", description="Stop being notified about an item")
+@app_commands.describe(item="Item ID to stop watching (leave empty to clear your watchlist in this server)")
+@app_commands.autocomplete(item=unwatch_item_autocomplete)
+async def unwatch_command(interaction: discord.Interaction, item: str = None):
+    if interaction.guild is None:
+        await interaction.response.send_message("❌ Use this command in a server.", ephemeral=True)
+        return
+    
+    item_id = normalize_item_id(item) if item else None
+    removed = watch_index.unwatch(interaction.user.id, interaction.guild.id, item_id)
+    if not removed:
+        await interaction.response.send_message(
+            f"❌ You are not watching **{item_id}**." if item_id else "❌ Your watchlist is empty.", ephemeral=True
+        )
+        return
+    await interaction.response.send_message(
+        f"✅ Stopped watching **{item_id}**." if item_id else f"✅ Cleared {removed} watches.", ephemeral=True
+    )
+
+async def history_item_autocomplete(interaction: discord.Interaction, current: str):
+    query = normalize_item_id(current)
+    stock_archive.load()
+    choices = []
+    for key in sorted(stock_archive.entries):
+        category, item_id = key.split("|", 1)
+        if query in item_id:
+            name = f"{stock_archive.entries[key]['name']} ({category.replace('_', ' ')})"
+            choices.append(app_commands.Choice(name=name[:100], value=key[:100]))
+    return choices[:25]
+
+# "2d 3h", "3h 20m" or "12m"
+def format_interval(seconds):
+    seconds = int(seconds)
+    if seconds >= 86400:
+        return f"{seconds // 86400}d {seconds % 86400 // 3600}h"
+    return f"{seconds // 3600}h {seconds % 3600 // 60}m" if seconds >= 3600 else f"{seconds // 60}m"
+
+@bot.tree.command(name="history", description="When an item or weather was last seen, and how often it shows up")
+@app_commands.describe(item="Item or weather ID, e.g. carrot")
+@app_commands.autocomplete(item=history_item_autocomplete)
+async def history_command(interaction: discord.Interaction, item: str):
+    # Autocomplete picks "category|item_id"; a typed item ID means its latest category
+    category, _, item_id = item.rpartition("|")
+    item_id = normalize_item_id(item_id)
+    started = time.perf_counter()
+    result = await stock_archive.history(item_id, category or None)
+    if result is None:
+        await interaction.response.send_message(f"❌ **{item_id}** has not been seen yet.", ephemeral=True)
+        return
+    category, entry, recent = result
+    
+    embed = discord.Embed(title=f"📜 {entry['name']} history", color=discord.Color.blurple())
+    embed.add_field(name="Last Seen", value=f"<t:{int(entry['last'])}:R>", inline=True)
+    embed.add_field(name="Times Seen", value=f"{entry['count']:,} since <t:{int(entry['first'])}:D>", inline=True)
+    if entry["count"] > 1:
+        interval = (entry["last"] - entry["first"]) / (entry["count"] - 1)
+        embed.add_field(name="Average Interval", value=format_interval(interval), inline=True)
+    lines = []
+    for row in recent:
+        line = f"<t:{int(row['start'])}:f>"
+        if row["quantity"]:
+            line += f" · x{row['quantity']}"
+        if row["price"] is not None:
+            line += f" · ${row['price']:,.0f}"
+        lines.append(line)
+    if lines:
+        embed.add_field(name="Recent", value="\n".join(lines), inline=False)
+    embed.set_footer(text=f"{item_id} · {category.replace('_', ' ').title()} · {(time.perf_counter() - started) * 1000:.1f} ms")
+    await interaction.response.send_message(embed=embed)
+
+# --- Sharded Deployment ---
+# The poller process fetches upstream once and publishes every fresh snapshot
+# to all connected shards as one JSON line over a Unix socket. A 304 is
+# published without data: shards keep their copy and treat it as current.
+IPC_LINE_LIMIT = 2 ** 24
+
+class SnapshotPublisher:
+    def __init__(self):
+        self.writers = set()
+        self.latest = {}  # url -> encoded line, replayed to shards that (re)connect
+
+    async def handle_shard(self, reader, writer):
+        self.writers.add(writer)
+        logging.info(f"🔌 Shard connected ({len(self.writers)} total)")
+        try:
+            for line in self.latest.values():
+                writer.write(line)
+            await writer.drain()
+            await reader.read()  # Shards never send; returns on disconnect
+        finally:
+            self.writers.discard(writer)
+            writer.close()
+            logging.info(f"🔌 Shard disconnected ({len(self.writers)} total)")
+
+    async def publish(self, url, status, data):
+        line = json.dumps({"url": url, "status": status, "data": data, "ts": time.time()}).encode() + b"\n"
+        if data is not None:
+            self.latest[url] = line
+        for writer in list(self.writers):
+            try:
+                writer.write(line)
+                await writer.drain()
+            except (ConnectionError, OSError):
+                self.writers.discard(writer)
+
+async def poll_and_publish(publisher, url, planner, hint):
+    while True:
+        try:
+            status, data = await snapshot_cache.refresh(url)
+        except Exception as e:
+            logging.error(f"⚠️ Poller error for {url}: {e}")
+            status, data = None, None
+        if data is None:
+            planner.record_error()
+        else:
+            now = datetime.now(timezone.utc).timestamp()
+            planner.record(*hint(data, now), now)
+            await publisher.publish(url, status, data if status == 200 else None)
+        await asyncio.sleep(planner.delay)
+
+async def run_poller():
+    """Entry point of RUN_MODE=poller"""
+    if os.path.exists(POLLER_SOCKET):
+        os.unlink(POLLER_SOCKET)
+    publisher = SnapshotPublisher()
+    server = await asyncio.start_unix_server(publisher.handle_shard, path=POLLER_SOCKET, limit=IPC_LINE_LIMIT)
+    logging.info(f"📡 Poller listening on {POLLER_SOCKET}")
+    await start_metrics_server()
+    try:
+        await asyncio.gather(
+            poll_and_publish(publisher, STOCK_API_URL, stock_planner, stock_poll_hint),
+            poll_and_publish(publisher, WEATHER_API_URL, weather_planner, weather_poll_hint)
+        )
+    finally:
+        server.close()
+        await http_client.close()
+
+async def follow_poller(on_snapshot):
+    """Receive snapshots from the poller, reconnecting whenever it goes away"""
+    while True:
+        try:
+            reader, writer = await asyncio.open_unix_connection(POLLER_SOCKET, limit=IPC_LINE_LIMIT)
+            logging.info(f"🔌 Connected to poller at {POLLER_SOCKET}")
+            while line := await reader.readline():
+                message = json.loads(line)
+                if message["data"] is None:
+                    current = snapshot_cache.touch(message["url"])
+                    if current is None:
+                        continue  # Nothing to refresh until the full snapshot arrives
+                    message["status"], message["data"] = current
+                else:
+                    snapshot_cache.store(message["url"], message["status"], message["data"])
+                await on_snapshot(message)
+            writer.close()
+        except (OSError, ValueError) as e:
+            logging.warning(f"⚠️ Poller connection lost: {e}")
+        await asyncio.sleep(5)
+
+async def on_poller_snapshot(message):
+    snapshot = (message["status"], message["data"])
+    try:
+        if message["url"] == STOCK_API_URL:
+            await check_new_stock(snapshot)
+        elif message["url"] == WEATHER_API_URL and subscriptions["weather"]:
+            await check_new_weather(snapshot=snapshot)
+    except Exception as e:
+        logging.error(f"⚠️ Failed to process poller snapshot: {e}")
+
+async def run_stub_shard():
+    """Entry point of RUN_MODE=stub_shard: log snapshots instead of posting them"""
+    async def log_snapshot(message):
+        lag = time.time() - message["ts"]
+        size = len(json.dumps(message["data"]))
+        logging.info(f"📥 {message['url']} ({size} bytes, {lag * 1000:.1f}ms after publish)")
+    await follow_poller(log_snapshot)
+
+# Run the bot (importing main, e.g. from benchmark.py, does not start anything)
+if __name__ == "__main__":
+    if RUN_MODE == "poller":
+        asyncio.run(run_poller())
+    elif RUN_MODE == "stub_shard":
+        asyncio.run(run_stub_shard())
+    else:
+        bot.run(TOKEN)